@@ -2,17 +2,13 @@ import argparse
 
 import pandas as pd
 
+from tcd.csvcache import read_csv_cached
 
-def clean_authors(input_file, output_file):
-    # Load input csv as pandas dataframe
-    df = pd.read_csv(input_file)
 
-    if 'handle' in df.columns:
-        # rename handle to author_id
-        df.rename(columns={'handle': 'author_id'}, inplace=True)
-
-    # only keep handle and is_needle columns
-    df = df[['author_id', 'is_needle']]
+def clean_authors(input_file, output_file, cache_dir=None):
+    # Load the author_id and is_needle columns of the input csv from its
+    # parquet cache, where handle is already renamed to author_id
+    df = read_csv_cached(input_file, columns=['author_id', 'is_needle'], cache_dir=cache_dir)
 
     # drop missing author id or is needle indicators
     df = df.dropna(subset=['author_id', 'is_needle'])
@@ -29,6 +25,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Clean authors data')
     parser.add_argument('-i', '--input', help='Input CSV file')
     parser.add_argument('-o', '--output', help='Output parquet file')
+    parser.add_argument('--cache-dir', default=None, help='Directory of the parquet cache of the input; .csvcache next to the input by default')
     args = parser.parse_args()
 
-    clean_authors(args.input, args.output)
\ No newline at end of file
+    clean_authors(args.input, args.output, cache_dir=args.cache_dir)
\ No newline at end of file
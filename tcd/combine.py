@@ -1,13 +1,627 @@
 #!/usr/bin/env python3
 import argparse
 import json
+import os
 import pickle
 import sys
 
 import networkx as nx
+import numpy as np
 import pandas as pd
 import pyarrow
-from networkx.algorithms.centrality import eigenvector_centrality_numpy
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import eigs, eigsh
+
+from tcd.graphio import touch_graph, write_graph
+from tcd.index import TweetIndex
+
+
+def eigenvector_centrality(G, v0=None, max_iter=100, tol=0):
+    """
+    eigenvector centrality of G, unweighted like the default of networkx's
+    eigenvector_centrality_numpy used before
+
+    Same computation as networkx's eigenvector_centrality_numpy, but the
+    solver can be warm-started from v0 (dict { node : centrality }), e.g.
+    the centrality of a neighbouring threshold. Nodes missing from v0 start
+    at the mean of v0.
+
+    raises TypeError if G is too small for the sparse eigensolver.
+    """
+    nodelist = list(G)
+    M = nx.to_scipy_sparse_array(G, nodelist=nodelist, weight=None, dtype=float)
+    if v0 is not None and len(v0) > 0:
+        fill = np.mean(list(v0.values()))
+        v0 = np.array([v0.get(node, fill) for node in nodelist])
+    _, eigenvector = eigs(M.T, k=1, which="LR", maxiter=max_iter, tol=tol, v0=v0)
+    largest = eigenvector.flatten().real
+    norm = np.sign(largest.sum()) * np.linalg.norm(largest)
+    return dict(zip(nodelist, (largest / norm).tolist()))
+
+
+def touch(*paths):
+    # null input -> null output
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            pass
+
+
+def combine_sweep(
+    interaction_df,
+    percents,
+    outgraphs,
+    groups,
+    node1,
+    node2,
+    sim,
+    sup,
+    min_centrality_percent=None,
+    graph_format="parquet",
+):
+    """
+    filter and aggregate interactions for several interaction percentiles
+    in one pass
+
+    The interactions are sorted by support once; the edges kept at each
+    percentile are a prefix of that order, so a single graph is grown from
+    the highest threshold to the lowest, and the centrality of each
+    threshold is warm-started from the previous one.
+
+    input:
+        percents : list of interaction percentiles
+        outgraphs, groups : output paths, aligned with percents
+        graph_format : parquet (directory of node and edge tables) or graphml
+    """
+    interaction_df = interaction_df.sort_values(sup, ascending=False, kind="stable")
+    supports = interaction_df[sup].to_numpy()
+    thresholds = [interaction_df[sup].quantile(p) for p in percents]
+
+    G = nx.Graph()
+    num_added = 0
+    centrality = None
+    for i in sorted(range(len(percents)), key=lambda i: -thresholds[i]):
+        percent = percents[i]
+        outgraph = outgraphs[i]
+        group = groups[i]
+        interaction_threshold = thresholds[i]
+        print(f"[{percent}] Interaction threshold:", interaction_threshold)
+
+        # only keep interactions above the specified percentile
+        num_kept = np.count_nonzero(supports > interaction_threshold)
+        for row in interaction_df.iloc[num_added:num_kept].itertuples(index=False):
+            G.add_edge(
+                getattr(row, node1),
+                getattr(row, node2),
+                weight=getattr(row, sim),
+                support=getattr(row, sup),
+            )
+        num_added = num_kept
+
+        if num_kept == 0:
+            touch_graph(outgraph, graph_format)
+            touch(group)
+            continue
+
+        try:
+            centrality = eigenvector_centrality(G, v0=centrality)
+        except TypeError as e:
+            print(e)
+            touch_graph(outgraph, graph_format)
+            touch(group)
+            centrality = None
+            continue
+        centrality_series = pd.Series(centrality)
+
+        centrality_threshold = (
+            centrality_series.quantile(min_centrality_percent)
+            if min_centrality_percent is not None
+            else 0.5
+        )
+        print(f"[{percent}] Centrality threshold:", centrality_threshold)
+
+        filtered_G = nx.subgraph_view(
+            G, filter_node=lambda node: centrality[node] > centrality_threshold
+        )
+        components = [list(c) for c in nx.connected_components(filtered_G)]
+        component_of = {node: i for i, c in enumerate(components) for node in c}
+        nodes = list(filtered_G)
+        write_graph(
+            outgraph,
+            pd.DataFrame(
+                {
+                    "node": nodes,
+                    "centrality": [centrality[node] for node in nodes],
+                    "component": [component_of[node] for node in nodes],
+                }
+            ),
+            pd.DataFrame(
+                [
+                    (u, v, d["weight"], d["support"])
+                    for u, v, d in filtered_G.edges(data=True)
+                ],
+                columns=["source", "target", "weight", "support"],
+            ),
+            graph_format,
+        )
+        write_group(components, group)
+
+
+def sparse_centrality(M, v0=None, max_iter=100, tol=0):
+    """
+    eigenvector centrality of the symmetric adjacency matrix M, normalized
+    like networkx's eigenvector_centrality_numpy
+
+    raises TypeError if M has fewer than 3 nodes, the limit of the eigs call
+    of networkx's eigenvector_centrality_numpy.
+    """
+    if M.shape[0] < 3:
+        raise TypeError(f"a graph of {M.shape[0]} nodes is too small for eigs")
+    _, eigenvector = eigsh(M, k=1, which="LA", maxiter=max_iter, tol=tol, v0=v0)
+    largest = eigenvector.ravel()
+    return largest / (np.sign(largest.sum()) * np.linalg.norm(largest))
+
+
+def write_group(components, group):
+    """
+    write groups to a group.json file; the members of each group are sorted,
+    so that the file does not depend on the backend that found the groups
+    """
+    os.makedirs(os.path.dirname(group) or ".", exist_ok=True)
+    with open(group, "w") as f:
+        json.dump([sorted(members) for members in components], f)
+
+
+def combine_sweep_sparse(
+    interaction_df,
+    percents,
+    outgraphs,
+    groups,
+    node1,
+    node2,
+    sim,
+    sup,
+    min_centrality_percent=None,
+    graph_format="parquet",
+):
+    """
+    same as combine_sweep, with the graph held as a scipy sparse adjacency
+    matrix instead of a networkx graph
+
+    Nodes are coded in order of first appearance in the sorted interactions,
+    which is the order in which combine_sweep adds them to its graph, so the
+    nodes of every threshold are a prefix of the codes. Groups are listed by
+    their first node in that order.
+    """
+    interaction_df = interaction_df.sort_values(sup, ascending=False, kind="stable")
+    supports = interaction_df[sup].to_numpy()
+    thresholds = [interaction_df[sup].quantile(p) for p in percents]
+
+    codes, node_ids = pd.factorize(
+        np.column_stack(
+            [interaction_df[node1].to_numpy(), interaction_df[node2].to_numpy()]
+        ).ravel()
+    )
+    u1, u2 = codes[0::2], codes[1::2]
+    sims = interaction_df[sim].to_numpy(dtype=float)
+    # number of nodes of the graph made of the first k + 1 edges
+    num_nodes = np.maximum.accumulate(np.maximum(u1, u2)) + 1
+
+    centrality = None
+    for i in sorted(range(len(percents)), key=lambda i: -thresholds[i]):
+        percent = percents[i]
+        outgraph = outgraphs[i]
+        group = groups[i]
+        interaction_threshold = thresholds[i]
+        print(f"[{percent}] Interaction threshold:", interaction_threshold)
+
+        # only keep interactions above the specified percentile
+        num_kept = np.count_nonzero(supports > interaction_threshold)
+        if num_kept == 0:
+            touch_graph(outgraph, graph_format)
+            touch(group)
+            continue
+
+        n = num_nodes[num_kept - 1]
+        # unweighted adjacency, as in combine_sweep
+        M = coo_matrix(
+            (
+                np.ones(2 * num_kept),
+                (
+                    np.concatenate([u1[:num_kept], u2[:num_kept]]),
+                    np.concatenate([u2[:num_kept], u1[:num_kept]]),
+                ),
+            ),
+            shape=(n, n),
+        ).tocsr()
+        # an interaction listed in both directions is a single edge
+        M.data[:] = 1
+
+        v0 = None
+        if centrality is not None:
+            v0 = np.full(n, centrality.mean())
+            v0[: len(centrality)] = centrality
+        try:
+            centrality = sparse_centrality(M, v0=v0)
+        except TypeError as e:
+            print(e)
+            touch_graph(outgraph, graph_format)
+            touch(group)
+            centrality = None
+            continue
+
+        centrality_threshold = (
+            pd.Series(centrality).quantile(min_centrality_percent)
+            if min_centrality_percent is not None
+            else 0.5
+        )
+        print(f"[{percent}] Centrality threshold:", centrality_threshold)
+        keep = centrality > centrality_threshold
+
+        kept = np.flatnonzero(keep)
+        _, labels = connected_components(M[kept][:, kept], directed=False)
+        labels, _ = pd.factorize(labels)
+        edges = np.flatnonzero(keep[u1[:num_kept]] & keep[u2[:num_kept]])
+        write_graph(
+            outgraph,
+            pd.DataFrame(
+                {
+                    "node": node_ids.take(kept),
+                    "centrality": centrality[kept],
+                    "component": labels,
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "source": node_ids.take(u1[edges]),
+                    "target": node_ids.take(u2[edges]),
+                    "weight": sims[edges],
+                    "support": supports[edges],
+                }
+            ),
+            graph_format,
+        )
+
+        order = np.argsort(labels, kind="stable")
+        components = np.split(
+            node_ids.take(kept[order]).tolist(), np.cumsum(np.bincount(labels))[:-1]
+        )
+        # no node above the centrality threshold -> no group, as networkx
+        write_group([c.tolist() for c in components if len(c) > 0], group)
+
+
+def support_dendrogram(interaction_df, node1, node2, sup):
+    """
+    single-linkage dendrogram of the interaction graph over decreasing support
+
+    The interactions are sorted by support once and merged with a union-find;
+    each merge of two components is recorded as a new cluster. The groups
+    of any interaction threshold are then cut from the dendrogram with
+    cut_dendrogram, without building the graph again.
+
+    return: DataFrame with one row per cluster
+        cluster : id; leaves (single nodes) come first, in order of first
+            appearance in the sorted interactions, then merges in order
+        parent : id of the cluster it is merged into, -1 for roots
+        support : support of the edge that formed the cluster; the cluster
+            exists for every interaction threshold below it
+        size : number of nodes
+        node : node of the leaves, None for merged clusters
+    """
+    interaction_df = interaction_df.sort_values(sup, ascending=False, kind="stable")
+    supports = interaction_df[sup].to_numpy()
+    codes, node_ids = pd.factorize(
+        np.column_stack(
+            [interaction_df[node1].to_numpy(), interaction_df[node2].to_numpy()]
+        ).ravel()
+    )
+    n = len(node_ids)
+
+    # a leaf appears with the first edge that holds its code
+    num_nodes = np.maximum.accumulate(np.maximum(codes[0::2], codes[1::2])) + 1
+    first_edge = np.searchsorted(num_nodes, np.arange(n), side="right")
+    cluster_support = supports[first_edge].tolist()
+    cluster_size = [1] * n
+    parent = [-1] * n
+
+    # union-find over node codes; cluster_of maps each root to its cluster
+    uf = list(range(n))
+    uf_size = [1] * n
+    cluster_of = list(range(n))
+    for a, b, s in zip(codes[0::2].tolist(), codes[1::2].tolist(), supports.tolist()):
+        while uf[a] != a:
+            uf[a] = uf[uf[a]]
+            a = uf[a]
+        while uf[b] != b:
+            uf[b] = uf[uf[b]]
+            b = uf[b]
+        if a == b:
+            continue
+        if uf_size[a] < uf_size[b]:
+            a, b = b, a
+        uf[b] = a
+        uf_size[a] += uf_size[b]
+
+        merged = len(parent)
+        parent[cluster_of[a]] = merged
+        parent[cluster_of[b]] = merged
+        parent.append(-1)
+        cluster_support.append(s)
+        cluster_size.append(uf_size[a])
+        cluster_of[a] = merged
+
+    return pd.DataFrame(
+        {
+            "cluster": np.arange(len(parent)),
+            "parent": parent,
+            "support": cluster_support,
+            "size": cluster_size,
+            "node": pd.Series(node_ids).convert_dtypes().reindex(range(len(parent))),
+        }
+    )
+
+
+def cut_dendrogram(dendrogram, threshold):
+    """
+    groups of the interaction graph made of the edges with support greater
+    than threshold
+
+    input:
+        dendrogram : DataFrame from support_dendrogram
+    return: list of groups (lists of nodes), ordered like the leaves
+    """
+    support = dendrogram["support"].to_numpy()
+    parent = dendrogram["parent"].to_numpy()
+    alive = support > threshold
+
+    # point every cluster at its parent while the parent exists, then jump
+    # pointers until each cluster points at its root at this threshold
+    up = np.arange(len(parent))
+    has_parent = parent >= 0
+    up[has_parent] = np.where(
+        alive[parent[has_parent]], parent[has_parent], up[has_parent]
+    )
+    while True:
+        jumped = up[up]
+        if np.array_equal(jumped, up):
+            break
+        up = jumped
+
+    leaves = np.flatnonzero(alive & (dendrogram["size"].to_numpy() == 1))
+    labels, _ = pd.factorize(up[leaves])
+    order = np.argsort(labels, kind="stable")
+    nodes = dendrogram["node"].iloc[leaves[order]].tolist()
+    bounds = np.cumsum(np.bincount(labels)).tolist()
+    return [nodes[start:end] for start, end in zip([0] + bounds, bounds)]
+
+
+def combine_dendrogram(
+    interaction_df, percents, groups, node1, node2, sup, dendrogram=None
+):
+    """
+    groups of several interaction percentiles cut from one support dendrogram,
+    without centrality filtering
+
+    input:
+        percents : list of interaction percentiles
+        groups : output paths, aligned with percents
+        dendrogram : optional output path of the dendrogram parquet
+    """
+    tree = support_dendrogram(interaction_df, node1, node2, sup)
+    if dendrogram is not None:
+        os.makedirs(os.path.dirname(dendrogram) or ".", exist_ok=True)
+        tree.to_parquet(dendrogram, index=False)
+
+    for percent, group in zip(percents, groups):
+        interaction_threshold = interaction_df[sup].quantile(percent)
+        print(f"[{percent}] Interaction threshold:", interaction_threshold)
+        write_group(cut_dendrogram(tree, interaction_threshold), group)
+
+
+def member_tweets(tweet_table, user_ids):
+    """
+    tweets of user_ids as a DataFrame of user_id, created_at, text
+
+    input:
+        tweet_table : TweetIndex, or dict { user_id : [(created_at, text)] }
+            of the older pickle
+    """
+    if isinstance(tweet_table, TweetIndex):
+        return tweet_table.lookup(user_ids).to_pandas()
+    return pd.DataFrame(
+        [
+            (user_id, created_at, text)
+            for user_id in user_ids
+            for created_at, text in tweet_table.get(user_id, [])
+        ],
+        columns=["user_id", "created_at", "text"],
+    )
+
+
+def iter_member_tweets(tweet_table, members, window, batch_size):
+    """
+    yield the tweets of members, batch_size members at a time, with their
+    parsed time and the start of their time window; both are null for tweets
+    whose created_at cannot be parsed
+    """
+    for start in range(0, len(members), batch_size):
+        tweets = member_tweets(tweet_table, members[start : start + batch_size])
+        tweets["time"] = pd.to_datetime(
+            tweets["created_at"], format="ISO8601", utc=True, errors="coerce"
+        )
+        tweets["window"] = tweets["time"].dt.floor(window)
+        yield tweets
+
+
+def shared_features(edge_df, members, p1_col, p2_col, w_col, top_features=10):
+    """
+    features of at least two members, by number of members then total weight
+    """
+    df = edge_df[edge_df[p1_col].isin(members)]
+    df = df.groupby(p2_col).agg(num_members=(p1_col, "nunique"), count=(w_col, "sum"))
+    df = df[df["num_members"] > 1].sort_values(
+        ["num_members", "count"], ascending=False, kind="stable"
+    )
+    return [
+        {"feature": str(feature), "num_members": int(n), "count": float(count)}
+        for feature, n, count in df.head(top_features).itertuples()
+    ]
+
+
+def group_context(
+    members,
+    tweet_table,
+    edge_df=None,
+    p1_col="uid",
+    p2_col="feature",
+    w_col="cnt",
+    window="1h",
+    batch_size=1000,
+    max_windows=20,
+    max_tweets=200,
+    top_features=10,
+):
+    """
+    context of a group, for triage
+
+    Member tweets are read from the tweet index in batches, twice: a first
+    pass counts the members active in each time window, a second one keeps
+    only the tweets of the windows where most members were co-active. At
+    most batch_size members' tweets are in memory at a time.
+
+    input:
+        members : list of user ids
+        edge_df : optional edge table of the feature, for the shared features
+        window : pandas frequency of the co-activity windows
+    return: dict of
+        num_members, num_tweets, first_tweet, last_tweet,
+        num_unparsed_tweets : number of tweets whose created_at cannot be
+            parsed; they are counted in num_tweets but in no window
+        co_activity : [{window, num_members, num_tweets}] of the windows with
+            at least two active members, most co-active first
+        shared_features : [{feature, num_members, count}]
+        tweets : [{user_id, created_at, text}] of the co-activity windows,
+            in time order, at most max_tweets
+    """
+    # first pass: activity per window; a member is in a single batch, so
+    # the numbers of members of the batches add up
+    activity = []
+    num_tweets, num_unparsed = 0, 0
+    first_tweet, last_tweet = None, None
+    for tweets in iter_member_tweets(tweet_table, members, window, batch_size):
+        num_tweets += len(tweets)
+        num_unparsed += int(tweets["time"].isna().sum())
+        tweets = tweets.dropna(subset=["time"])
+        if len(tweets) == 0:
+            continue
+        activity.append(
+            tweets.groupby("window").agg(
+                num_members=("user_id", "nunique"), num_tweets=("user_id", "size")
+            )
+        )
+        first = tweets["time"].min()
+        last = tweets["time"].max()
+        first_tweet = first if first_tweet is None else min(first_tweet, first)
+        last_tweet = last if last_tweet is None else max(last_tweet, last)
+
+    if activity:
+        activity = pd.concat(activity).groupby(level=0).sum()
+    else:
+        activity = pd.DataFrame(
+            {"num_members": [], "num_tweets": []}, index=pd.DatetimeIndex([])
+        )
+    co_activity = (
+        activity[activity["num_members"] > 1]
+        .rename_axis("window")
+        .reset_index()
+        .sort_values(
+            ["num_members", "num_tweets", "window"],
+            ascending=[False, False, True],
+            kind="stable",
+        )
+        .head(max_windows)
+    )
+
+    # second pass: tweets of the co-activity windows
+    tweets = []
+    if len(co_activity) > 0:
+        windows = pd.DatetimeIndex(co_activity["window"])
+        for batch in iter_member_tweets(tweet_table, members, window, batch_size):
+            tweets.append(batch[batch["window"].isin(windows)])
+    if tweets:
+        tweets = (
+            pd.concat(tweets)
+            .sort_values(["time", "user_id"], kind="stable")
+            .head(max_tweets)
+        )
+    else:
+        tweets = pd.DataFrame(columns=["user_id", "created_at", "text"])
+
+    return {
+        "num_members": len(members),
+        "num_tweets": num_tweets,
+        "num_unparsed_tweets": num_unparsed,
+        "first_tweet": None if first_tweet is None else first_tweet.isoformat(),
+        "last_tweet": None if last_tweet is None else last_tweet.isoformat(),
+        "co_activity": [
+            {
+                "window": window_start.isoformat(),
+                "num_members": int(n),
+                "num_tweets": int(count),
+            }
+            for window_start, n, count in co_activity[
+                ["window", "num_members", "num_tweets"]
+            ].itertuples(index=False)
+        ],
+        "shared_features": (
+            []
+            if edge_df is None
+            else shared_features(
+                edge_df, members, p1_col, p2_col, w_col, top_features=top_features
+            )
+        ),
+        "tweets": [
+            {"user_id": user_id, "created_at": created_at, "text": text}
+            for user_id, created_at, text in tweets[
+                ["user_id", "created_at", "text"]
+            ].itertuples(index=False)
+        ],
+    }
+
+
+def write_contexts(groups, contexts, tweet_table, edge_df=None, **kwargs):
+    """
+    write the context of every group of each group file
+
+    input:
+        groups : paths of group files written by the sweeps
+        contexts : output paths, aligned with groups; each holds a list of
+            group contexts, aligned with the groups of its group file
+        kwargs : passed to group_context
+    """
+    for group, context in zip(groups, contexts):
+        if os.path.getsize(group) == 0:
+            # null input -> null output
+            touch(context)
+            continue
+        with open(group, "r") as f:
+            components = json.load(f)
+        result = [
+            dict(
+                group_id=group_id,
+                **group_context(members, tweet_table, edge_df=edge_df, **kwargs),
+            )
+            for group_id, members in enumerate(components)
+        ]
+        num_unparsed = sum(c["num_unparsed_tweets"] for c in result)
+        if num_unparsed > 0:
+            print(
+                f"WARNING: {num_unparsed} member tweets of {group} have a created_at that cannot be parsed; they are left out of the co-activity windows of {context}"
+            )
+        os.makedirs(os.path.dirname(context) or ".", exist_ok=True)
+        with open(context, "w") as f:
+            json.dump(result, f)
 
 
 def main(args):
@@ -29,7 +643,7 @@ def main(args):
         dest="twttext",
         type=str,
         required=False,
-        help="path to input indexed text of tweets",
+        help="path to input index of tweets written by tcd.index (or a pickle of the older format)",
     )
     parser.add_argument(
         "-o",
@@ -37,8 +651,8 @@ def main(args):
         action="store",
         dest="outgraph",
         type=str,
-        required=True,
-        help="path to output file of the graphml for gephi vis",
+        required=False,
+        help="path to output graph: a directory of parquet node and edge tables, or a graphml file with --graph-format graphml; with several --min-interaction-percent, it must contain {percent}. Required unless --groups dendrogram",
     )
     parser.add_argument(
         "-g",
@@ -47,7 +661,7 @@ def main(args):
         dest="group",
         type=str,
         required=True,
-        help="path to output file of context of each suspicious groups",
+        help="path to output file of the members of each suspicious group; with several --min-interaction-percent, it must contain {percent}",
     )
     parser.add_argument(
         "--node1",
@@ -83,9 +697,10 @@ def main(args):
     )
     parser.add_argument(
         "--min-interaction-percent",
-        default=0.05,
-        type=float,
-        help="Interaction strengths less than this percentile will be discarded",
+        default=["0.05"],
+        nargs="+",
+        type=str,
+        help="Interaction strengths less than this percentile will be discarded. Several percentiles can be given to produce all their outputs in one pass; {percent} in the output paths is replaced by each of them as written here",
     )
     parser.add_argument(
         "--min-centrality-percent",
@@ -94,6 +709,72 @@ def main(args):
         help="Nodes with centrality less than this percentile will be discarded. If not specified, a hard cut of 0.5 will be applied to follow the Pacheco source code.",
     )
 
+    parser.add_argument(
+        "--backend",
+        default="sparse",
+        choices=["sparse", "networkx"],
+        help="graph backend: scipy sparse matrices, or networkx graphs",
+    )
+
+    parser.add_argument(
+        "--graph-format",
+        default="parquet",
+        choices=["parquet", "graphml"],
+        help="format of the output graph; a parquet graph can be exported later with tcd.graphio",
+    )
+    parser.add_argument(
+        "--groups",
+        default="centrality",
+        choices=["centrality", "dendrogram"],
+        help="how groups are formed: connected components of the graph filtered by centrality, or cuts of the support dendrogram of the unfiltered graph (no graph output)",
+    )
+    parser.add_argument(
+        "--dendrogram",
+        default=None,
+        type=str,
+        help="path to output parquet file of the support dendrogram, with --groups dendrogram",
+    )
+
+    parser.add_argument(
+        "--context",
+        default=None,
+        type=str,
+        help="path to output file of the context of each group: member tweets of the co-activity windows, co-activity timestamps and shared top features; needs -t, and {percent} like -g",
+    )
+    parser.add_argument(
+        "--edges",
+        default=None,
+        type=str,
+        help="path to input edge parquet file of the feature, for the shared features of --context",
+    )
+    parser.add_argument(
+        "--p1col", default="uid", type=str, help="column name of nodes in partite 1"
+    )
+    parser.add_argument(
+        "--p2col", default="feature", type=str, help="column name of nodes in partite 2"
+    )
+    parser.add_argument(
+        "--wcol", default="cnt", type=str, help="column name of edge weights"
+    )
+    parser.add_argument(
+        "--context-window",
+        default="1h",
+        type=str,
+        help="length of the co-activity windows, as a pandas frequency",
+    )
+    parser.add_argument(
+        "--context-max-tweets",
+        default=200,
+        type=int,
+        help="maximum number of member tweets in the context of a group",
+    )
+    parser.add_argument(
+        "--context-batch-size",
+        default=1000,
+        type=int,
+        help="number of members whose tweets are read from the index at a time",
+    )
+
     args = parser.parse_args(args)
     interaction = args.interaction
     twttext = args.twttext
@@ -105,65 +786,96 @@ def main(args):
     sup = args.sup
     min_interaction_percent = args.min_interaction_percent
     min_centrality_percent = args.min_centrality_percent
+    backend = args.backend
+    group_mode = args.groups
+    dendrogram = args.dendrogram
+    graph_format = args.graph_format
+    context = args.context
+
+    if context is not None and twttext is None:
+        parser.error("--context needs -t")
+
+    if group_mode == "centrality" and outgraph is None:
+        parser.error("-o is required unless --groups dendrogram")
+    if group_mode == "dendrogram":
+        outgraph = None
+    if len(min_interaction_percent) > 1 and not (
+        "{percent}" in group
+        and (outgraph is None or "{percent}" in outgraph)
+        and (context is None or "{percent}" in context)
+    ):
+        parser.error(
+            "several --min-interaction-percent require {percent} in -o, -g and --context"
+        )
+    percents = [float(p) for p in min_interaction_percent]
+    outgraphs = (
+        [outgraph.replace("{percent}", p) for p in min_interaction_percent]
+        if outgraph is not None
+        else []
+    )
+    groups = [group.replace("{percent}", p) for p in min_interaction_percent]
+    contexts = (
+        [context.replace("{percent}", p) for p in min_interaction_percent]
+        if context is not None
+        else []
+    )
 
     # read input
     try:
         interaction_df = pd.read_parquet(interaction)
-
-        # only keep interactions above the specified percentile
-        interaction_threshold = interaction_df[sup].quantile(min_interaction_percent)
-        print("Interaction threshold:", interaction_threshold)
-        interaction_df = interaction_df[interaction_df[sup] > interaction_threshold]
     except (pyarrow.lib.ArrowIOError, pyarrow.lib.ArrowInvalid):
         interaction_df = list()
 
     has_text = twttext is not None
     if has_text:
-        with open(twttext, "rb") as f:
-            tweet_table = pickle.load(f)
-
-    if len(interaction_df) > 0:
-        # do work
-        G = nx.Graph()
-        for idx, row in interaction_df.iterrows():
-            G.add_edge(row[node1], row[node2], weight=row[sim], support=row[sup])
-
-        del interaction_df
-
-        try:
-            centrality = pd.Series(eigenvector_centrality_numpy(G, max_iter=100))
-        except TypeError as e:
-            # null input -> null output
-            with open(outgraph, "a") as f:
-                print(e)
-                pass
-            with open(group, "a") as f:
-                print(e)
-                pass
-            return
+        if os.path.isdir(twttext):
+            tweet_table = TweetIndex(twttext)
+        else:
+            with open(twttext, "rb") as f:
+                tweet_table = pickle.load(f)
 
-        centrality_threshold = (
-            centrality.quantile(min_centrality_percent)
-            if min_centrality_percent is not None
-            else 0.5
+    if len(interaction_df) > 0 and group_mode == "dendrogram":
+        combine_dendrogram(
+            interaction_df, percents, groups, node1, node2, sup, dendrogram=dendrogram
         )
-        print("Centrality threshold:", centrality_threshold)
-
-        filtered_G = nx.subgraph_view(
-            G, filter_node=lambda node: centrality.loc[node] > centrality_threshold
+    elif len(interaction_df) > 0:
+        # do work and write output
+        sweep = combine_sweep_sparse if backend == "sparse" else combine_sweep
+        sweep(
+            interaction_df,
+            percents,
+            outgraphs,
+            groups,
+            node1,
+            node2,
+            sim,
+            sup,
+            min_centrality_percent=min_centrality_percent,
+            graph_format=graph_format,
         )
-        nx.write_graphml(filtered_G, outgraph)
-
-        components = [list(c) for c in nx.connected_components(filtered_G)]
-        with open(group, "w") as f:
-            json.dump(components, f)
-
     else:
-        # null input -> null output
-        with open(outgraph, "a") as f:
-            pass
-        with open(group, "a") as f:
-            pass
+        for outgraph in outgraphs:
+            touch_graph(outgraph, graph_format)
+        touch(*groups, *([dendrogram] if dendrogram else []))
+
+    if has_text and contexts:
+        edge_df = (
+            pd.read_parquet(args.edges, columns=[args.p1col, args.p2col, args.wcol])
+            if args.edges is not None
+            else None
+        )
+        write_contexts(
+            groups,
+            contexts,
+            tweet_table,
+            edge_df=edge_df,
+            p1_col=args.p1col,
+            p2_col=args.p2col,
+            w_col=args.wcol,
+            window=args.context_window,
+            batch_size=args.context_batch_size,
+            max_tweets=args.context_max_tweets,
+        )
 
 
 if __name__ == "__main__":
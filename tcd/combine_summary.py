@@ -3,6 +3,8 @@
 import argparse
 import pandas as pd
 
+from tcd.results import partition_filter, read_results
+
 
 def combine_summaries(input_files, output_file):
     # List to store individual dataframes
@@ -16,6 +18,40 @@ def combine_summaries(input_files, output_file):
     # Combine all dataframes
     combined_df = pd.concat(dfs, ignore_index=True)
 
+    write_best_results(combined_df, output_file)
+
+
+def combine_results(
+    store, output_file, datasets=None, features=None, interaction_percents=None
+):
+    # Query the metrics of the groups of the given partitions (all of them by
+    # default) from the results store, in the row order of the summary CSV files
+    combined_df = read_results(
+        store,
+        columns=[
+            "dataset",
+            "feature",
+            "interaction_percent",
+            "group_id",
+            "precision",
+            "recall",
+            "f1_score",
+            "roc_auc",
+        ],
+        filter=partition_filter(
+            dataset=datasets,
+            feature=features,
+            interaction_percent=interaction_percents,
+        ),
+    )
+    combined_df = combined_df.sort_values(
+        by=["feature", "dataset", "interaction_percent", "group_id"]
+    ).reset_index(drop=True)
+
+    write_best_results(combined_df, output_file)
+
+
+def write_best_results(combined_df, output_file):
     # Group by 'dataset' and 'feature', then select the row with max 'f1_score'
     result = combined_df.loc[
         combined_df.groupby(["dataset", "feature"])["f1_score"].idxmax()
@@ -73,14 +109,43 @@ def main():
     parser = argparse.ArgumentParser(
         description="Combine summary CSV files and select rows with max f1_score."
     )
-    parser.add_argument(
-        "-i", "--input", nargs="+", required=True, help="Input CSV files"
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("-i", "--input", nargs="+", help="Input CSV files")
+    inputs.add_argument(
+        "--results", help="Path to the results store written by tcd.group_stats"
     )
     parser.add_argument("-o", "--output", required=True, help="Output CSV file")
+    parser.add_argument(
+        "--datasets",
+        nargs="+",
+        default=None,
+        help="With --results, only these datasets",
+    )
+    parser.add_argument(
+        "--features",
+        nargs="+",
+        default=None,
+        help="With --results, only these features",
+    )
+    parser.add_argument(
+        "--interaction-percents",
+        nargs="+",
+        default=None,
+        help="With --results, only these interaction percents",
+    )
 
     args = parser.parse_args()
 
-    combine_summaries(args.input, args.output)
+    if args.results is not None:
+        combine_results(
+            args.results,
+            args.output,
+            datasets=args.datasets,
+            features=args.features,
+            interaction_percents=args.interaction_percents,
+        )
+    else:
+        combine_summaries(args.input, args.output)
 
 
 if __name__ == "__main__":
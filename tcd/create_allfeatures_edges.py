@@ -1,7 +1,7 @@
 import argparse
 import pandas as pd
 
-def create_allfeatures_edges(selected_hashtags_edge_file, flagonly_edge_file, output_file):
+def create_allfeatures_edges(selected_hashtags_edge_file, flagonly_edge_file, output_file, write_csv=False):
     """
     Combine the selected_hashtags and flagonly edge files into a single edge file.
     
@@ -13,6 +13,8 @@ def create_allfeatures_edges(selected_hashtags_edge_file, flagonly_edge_file, ou
         Path to the flagonly edge parquet file
     output_file : str
         Path to output the combined edge parquet file
+    write_csv : bool
+        Also write a CSV copy of the combined edges next to output_file
     """
     # Load the edge files
     try:
@@ -36,9 +38,10 @@ def create_allfeatures_edges(selected_hashtags_edge_file, flagonly_edge_file, ou
         # Save the combined edge file
         combined_df.to_parquet(output_file, index=False)
         
-        # Also save as CSV for reference
-        csv_output = output_file.replace('.parquet', '.csv')
-        combined_df.to_csv(csv_output, index=False)
+        # Also save as CSV for reference, if asked
+        if write_csv:
+            csv_output = output_file.replace('.parquet', '.csv')
+            combined_df.to_csv(csv_output, index=False)
         
         print(f"Created {len(combined_df)} combined edges for {len(combined_df['uid'].unique())} unique authors")
         
@@ -51,13 +54,15 @@ def main():
     parser.add_argument("--selected-hashtags", required=True, help="Input selected_hashtags edge parquet file")
     parser.add_argument("--flagonly", required=True, help="Input flagonly edge parquet file")
     parser.add_argument("-o", "--output", required=True, help="Output combined edge parquet file")
+    parser.add_argument("--csv", action="store_true", help="Also write a CSV copy of the edges next to the output")
     
     args = parser.parse_args()
     
     create_allfeatures_edges(
         args.selected_hashtags,
         args.flagonly,
-        args.output
+        args.output,
+        write_csv=args.csv
     )
 
 if __name__ == "__main__":
@@ -12,7 +12,8 @@ def create_edges(hashtag_counts, top_hashtags, outdir, p1_col, p2_col, w_col, nu
 
     top_hashtag_cols = ['hashtags', 'kld']
 
-    df_counts = pd.read_csv(hashtag_counts)
+    # author ids are strings, as in the other edge files and authors.parquet
+    df_counts = pd.read_csv(hashtag_counts, dtype={'author_id': str, 'handle': str})
     df_top = pd.read_csv(top_hashtags)
 
     assert df_counts.columns.tolist() in possible_count_cols, f"Columns must be one of {possible_count_cols}"
@@ -1,52 +1,74 @@
 import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-def create_flagonly_edges(input_file, output_file, flags):
-    # Load authors CSV file
-    df = pd.read_csv(input_file)
-    
-    # Standardize column names - ensure we have author_id
-    if 'handle' in df.columns and 'author_id' not in df.columns:
-        df.rename(columns={'handle': 'author_id'}, inplace=True)
+from tcd.csvcache import cached_parquet
+
+def flag_values(values):
+    """
+    boolean array of the flags of a column that are set: 1, True or "true"
+    (in any case); anything else, missing values included, is not set
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.eq(1).to_numpy(dtype=bool, na_value=False)
+    values = values.astype(object)
+    is_set = values.eq(1) | values.astype(str).str.lower().eq('true')
+    return is_set.to_numpy(dtype=bool, na_value=False)
+
+def create_flagonly_edges(input_file, output_file, flags, cache_dir=None, write_csv=False):
+    # Load authors CSV file from its parquet cache, where handle is already
+    # renamed to author_id
+    cached = cached_parquet(input_file, cache_dir)
+    columns = pq.read_schema(cached).names
     
     # Ensure flags are present in the dataframe
-    available_flags = [col for col in df.columns if col in flags]
+    available_flags = [col for col in columns if col in flags]
     if not available_flags:
         raise ValueError(f"None of the requested flags {flags} found in the input file")
+
+    # only read the author ids and the requested flags
+    df = pd.read_parquet(cached, columns=['author_id'] + available_flags)
     
-    # Create a list to store edges
-    edges = []
-    
-    # For each author, create an edge for each flag that is True/1
-    for _, row in df.iterrows():
-        author_id = row['author_id']
-        for flag in available_flags:
-            # Check if the flag value is true (1, True, etc.)
-            if pd.notna(row[flag]) and (row[flag] == 1 or row[flag] is True or str(row[flag]).lower() == 'true'):
-                # Add an edge (author_id, flag, 1)
-                edges.append((author_id, flag, 1))
-    
-    # Create the edge dataframe
-    edge_df = pd.DataFrame(edges, columns=['uid', 'feature', 'cnt'])
-    
-    # Save as parquet
-    edge_df['uid'] = edge_df['uid'].astype(str)
-    edge_df['feature'] = edge_df['feature'].astype(str)
-    edge_df['cnt'] = edge_df['cnt'].astype(int)  # Make sure cnt remains an integer
-    edge_df.to_parquet(output_file, index=False)
-    
-    # Also save as CSV
-    csv_output = output_file.replace('.parquet', '.csv')
-    edge_df.to_csv(csv_output, index=False)
-    
-    print(f"Created {len(edge_df)} edges for {len(edge_df['uid'].unique())} unique authors")
+    # normalize every flag column to booleans at once
+    # a flag is set if its value is 1, True or "true" (in any case)
+    is_set = np.column_stack([flag_values(df[flag]) for flag in available_flags])
+
+    # (author, flag) pairs of the set flags, author by author, then in the
+    # order of the flags
+    rows, flag_codes = np.nonzero(is_set)
+
+    # Create the edge table; the feature column is written dictionary-encoded
+    # from the flag codes, without building a string per edge
+    edge_table = pa.table({
+        'uid': pa.array(df['author_id'].iloc[rows].astype(str), pa.string()),
+        'feature': pa.DictionaryArray.from_arrays(
+            pa.array(flag_codes, pa.int32()), pa.array(available_flags, pa.string())
+        ),
+        'cnt': pa.array(np.ones(len(rows), dtype=np.int64)),
+    })
+
+    # Save as parquet; without the arrow schema, readers get plain string
+    # columns as before
+    pq.write_table(edge_table, output_file, store_schema=False)
+
+    # Also save as CSV, if asked
+    if write_csv:
+        csv_output = output_file.replace('.parquet', '.csv')
+        edge_table.to_pandas().to_csv(csv_output, index=False)
+
+    print(f"Created {edge_table.num_rows} edges for {len(pc.unique(edge_table['uid']))} unique authors")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Create edge files based on author flags")
     parser.add_argument("-i", "--input", required=True, help="Input authors CSV file")
     parser.add_argument("-o", "--output", required=True, help="Output parquet file")
     parser.add_argument("-f", "--flags", nargs='+', required=True, help="List of flag columns to use")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the parquet cache of the input; .csvcache next to the input by default")
+    parser.add_argument("--csv", action="store_true", help="Also write a CSV copy of the edges next to the output")
     
     args = parser.parse_args()
     
-    create_flagonly_edges(args.input, args.output, args.flags)
\ No newline at end of file
+    create_flagonly_edges(args.input, args.output, args.flags, cache_dir=args.cache_dir, write_csv=args.csv)
\ No newline at end of file
@@ -2,15 +2,25 @@ import pandas as pd
 import argparse
 from ast import literal_eval
 
-# support filter: per account at least 5 tweets per day and five unique hashtags
+from tcd.csvcache import read_csv_cached
 
+# support filter: per account at least 5 tweets per day and five unique hashtags
 
-def process_tweets(input_file, output, min_num_tweets, min_num_hashtags):
-    # Read the CSV file
-    df = pd.read_csv(input_file, engine="python")
 
-    # keep only the columns we need
-    df = df[["author_id", "created_at", "is_needle", "hashtags"]]
+def process_tweets(
+    input_file,
+    output,
+    min_num_tweets,
+    min_num_hashtags,
+    cache_dir=None,
+    write_csv=False,
+):
+    # Read the columns we need from the parquet cache of the CSV file
+    df = read_csv_cached(
+        input_file,
+        columns=["author_id", "created_at", "is_needle", "hashtags"],
+        cache_dir=cache_dir,
+    )
 
     # Convert 'created_at' to datetime
     initial_count = len(df)
@@ -118,7 +128,8 @@ def process_tweets(input_file, output, min_num_tweets, min_num_hashtags):
     # save
 
     df.to_parquet(output)
-    df.to_csv(output.replace(".parquet", ".csv"), index=False)
+    if write_csv:
+        df.to_csv(output.replace(".parquet", ".csv"), index=False)
 
 
 if __name__ == "__main__":
@@ -137,7 +148,24 @@ if __name__ == "__main__":
         default=4,
         help="Minimum number of hashtags per (account, day)",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Directory of the parquet cache of the input; .csvcache next to the input by default",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="Also write a CSV copy of the edges next to the output",
+    )
 
     args = parser.parse_args()
 
-    process_tweets(args.input, args.output, args.min_num_tweets, args.min_num_hashtags)
+    process_tweets(
+        args.input,
+        args.output,
+        args.min_num_tweets,
+        args.min_num_hashtags,
+        cache_dir=args.cache_dir,
+        write_csv=args.csv,
+    )
@@ -1,16 +1,188 @@
+import numpy as np
 import pandas as pd
 import argparse
-from ast import literal_eval
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import blake2b
+from os.path import join
+import pyarrow.parquet as pq
+
+from tcd.csvcache import cached_parquet, read_csv_cached
 
 # support filter: per account at least 5 tweets per day and five unique hashtags
 
 
-def process_tweets(input_file, output, min_num_tweets, min_num_hashtags):
-    # Read the CSV file
-    df = pd.read_csv(input_file, engine="python")
+COLUMNS = ["author_id", "created_at", "is_needle", "hashtags"]
+
+
+def parse_hashtags(hashtags):
+    """
+    explode the string representations of hashtag lists, e.g. "['#a', '#b']"
+
+    input:
+        hashtags : Series of strings
+    return: Series of hashtags, indexed by the index of their list; empty
+        strings and lists that are not quoted strings contribute nothing
+    """
+    # quoted strings, with backslash escapes as in "['#it\\'s']"
+    values = hashtags.dropna().str.extractall(
+        r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\""
+    )
+    # an empty quoted string may be extracted as nan rather than ""
+    values = values[0].fillna(values[1]).dropna()
+    values = values.str.replace(r"\\(.)", r"\1", regex=True)
+    values = values[~values.isin(["", " "])]
+    return values.droplevel("match")
+
+
+def hashtag_sets(df, min_num_tweets, min_num_hashtags):
+    """
+    set of unique hashtags of every (account, date) pair with at least
+    min_num_tweets tweets and min_num_hashtags unique hashtags
+
+    input:
+        df : DataFrame of author_id, date, hashtags (string representations)
+    return:
+        pairs : DataFrame of author_id, date, sorted by both; its index is the
+            code of the pair
+        pair_codes, hashtags : arrays of the hashtags of each pair, one row
+            per unique (pair, hashtag)
+    """
+    #
+    # keep (account, date) pairs with at least the minimum number of tweets
+    #
+    num_tweets = df.groupby(["author_id", "date"])["date"].transform("size")
+    df = df[num_tweets.to_numpy() >= min_num_tweets]
+
+    #
+    # create hashtag usage features
+    # in this version we use the set of unique hashtags per (account, date) pair
+    #
+    hashtags = parse_hashtags(df["hashtags"])
+    df = (
+        df[["author_id", "date"]]
+        .loc[hashtags.index]
+        .assign(hashtags=hashtags.to_numpy())
+        .drop_duplicates()
+    )
+
+    #
+    # keep (account, date) pairs with at least the minimum number of hashtags
+    #
+    num_hashtags = df.groupby(["author_id", "date"])["date"].transform("size")
+    df = df[num_hashtags.to_numpy() >= min_num_hashtags]
+
+    pair_codes = df.groupby(["author_id", "date"], sort=True).ngroup().to_numpy()
+    _, first = np.unique(pair_codes, return_index=True)
+    pairs = df[["author_id", "date"]].iloc[first].reset_index(drop=True)
+    return pairs, pair_codes, df["hashtags"].to_numpy()
+
+
+def stable_hash(values):
+    """
+    64-bit blake2b hash of the string of each value, the same in every
+    process and run, unlike the builtin hash
+    """
+    return np.array(
+        [
+            int.from_bytes(blake2b(str(v).encode(), digest_size=8).digest(), "little")
+            for v in values
+        ],
+        dtype=np.uint64,
+    )
+
+
+def mix(h):
+    """
+    splitmix64 finalizer of an array of uint64
+    """
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def feature_ids(pair_dates, pair_codes, hashtags):
+    """
+    64-bit id of the feature of each (account, date) pair, a hash of the date
+    and the set of hashtags of the pair
+
+    The set hash is the sum (mod 2^64) of the mixed hashes of its hashtags,
+    so it does not depend on the order of the hashtags and is computed
+    without building the feature strings.
+
+    input:
+        pair_dates : array of the date of each pair
+        pair_codes, hashtags : as returned by hashtag_sets
+    return: int64 array, aligned with pair_dates
+    """
+    codes, uniques = pd.factorize(hashtags)
+    elements = mix(stable_hash(uniques))[codes]
+
+    set_hash = np.zeros(len(pair_dates), dtype=np.uint64)
+    if len(pair_codes) > 0:
+        order = np.argsort(pair_codes, kind="stable")
+        sorted_codes = pair_codes[order]
+        starts = np.flatnonzero(
+            np.concatenate([[True], sorted_codes[1:] != sorted_codes[:-1]])
+        )
+        set_hash[sorted_codes[starts]] = np.add.reduceat(elements[order], starts)
+
+    date_codes, dates = pd.factorize(pair_dates)
+    return mix(set_hash ^ stable_hash(dates)[date_codes]).view(np.int64)
+
+
+def feature_names(pairs, pair_codes, hashtags):
+    """
+    readable name of each feature id, date + "_" + the hashtags of the set
+    joined with "-" in sorted order
+
+    input:
+        pairs : DataFrame of date and feature, indexed by pair code
+        pair_codes, hashtags : as returned by hashtag_sets
+    return: DataFrame of feature, name, sorted by feature
+    """
+    # one pair per feature is enough to name it
+    first = pairs.drop_duplicates("feature")
+    keep = np.isin(pair_codes, first.index.to_numpy())
+    sets = (
+        pd.DataFrame({"pair": pair_codes[keep], "hashtag": hashtags[keep]})
+        .sort_values(["pair", "hashtag"])
+        .groupby("pair")["hashtag"]
+        .agg("-".join)
+    )
+    names = pd.DataFrame(
+        {
+            "feature": first["feature"].to_numpy(),
+            "name": first["date"].astype(str).to_numpy()
+            + "_"
+            + sets.loc[first.index].to_numpy(),
+        }
+    )
+    return names.sort_values("feature").reset_index(drop=True)
+
+
+def names_path(output):
+    """
+    path of the side table of feature names of an edge file
+    """
+    return output[: -len(".parquet")] + ".names.parquet"
 
-    # keep only the columns we need
-    df = df[["author_id", "created_at", "is_needle", "hashtags"]]
+
+def process_tweets(
+    input_file,
+    output,
+    min_num_tweets,
+    min_num_hashtags,
+    cache_dir=None,
+    write_csv=False,
+):
+    # Read the CSV file, through its parquet cache
+    df = read_csv_cached(input_file, columns=COLUMNS, cache_dir=cache_dir)
 
     # Convert 'created_at' to datetime
     initial_count = len(df)
@@ -33,103 +205,155 @@ def process_tweets(input_file, output, min_num_tweets, min_num_hashtags):
 
     # extract date
     df["date"] = df["created_at"].dt.date
-    df = df.sort_values(by="created_at")
+
+    pairs, pair_codes, hashtags = hashtag_sets(df, min_num_tweets, min_num_hashtags)
 
     #
-    # keep (account, date) pairs with at least the minimum number of tweets
+    # create the feature data based on date and hashtag set
+    # this is the feature column for pacheo case study 3, as a 64-bit id
     #
+    pairs["feature"] = feature_ids(
+        pairs["date"].astype(str).to_numpy(), pair_codes, hashtags
+    )
 
-    df_groups = (
-        df[["author_id", "date"]].groupby(["author_id", "date"]).size()
-    ).reset_index(name="size")
+    # drop features that only appear once
+    # appearing once implies that only a single account has the feature
+    pairs = pairs[pairs.groupby("feature")["feature"].transform("size") > 1]
+    names = feature_names(pairs, pair_codes, hashtags)
 
-    df_groups = df_groups[df_groups["size"] >= min_num_tweets]
-    df_groups.drop(columns=["size"], inplace=True)
-    df = df.merge(df_groups, on=["author_id", "date"], how="inner")
+    # structure to uid, feature, cnt for compatibility with pipeline
+    df = pairs[["author_id", "feature"]].copy()
+    df["cnt"] = 1
 
-    #
-    # create hashtag usage features
-    # in this version we use the set of unique hashtags per (account, date) pair
-    #
+    # rename author_id to uid
+    df.rename(columns={"author_id": "uid"}, inplace=True)
 
-    #  first, convert string representation of hashtags to list, handling potential errors
-    def eval_lists(x):
-        try:
-            ls = literal_eval(x)
+    # sort by feature column
+    df = df.sort_values(by=["feature", "uid"])
 
-            # filter out empty strings from list
-            ls = [s for s in ls if s not in {"", " ", None}]
+    # save
 
-            return ls
-        except Exception:
-            return []
+    df.to_parquet(output)
+    if write_csv:
+        df.to_csv(output.replace(".parquet", ".csv"), index=False)
+    names.to_parquet(names_path(output), index=False)
 
-    df["hashtags"] = df["hashtags"].apply(eval_lists)
 
-    # drop the rows with empty hashtag lists. These do not contribute
-    # to the hashtag set feature
-    df = (
-        df[df["hashtags"].apply(lambda x: len(x) > 0)]
-        .sort_values(by=["author_id", "date"])
-        .reset_index()
-    )
-
-    # now, aggregate the hashtag lists for each (account, date) pair
-    # the resulting list is the set of unique hashtags shared by the account in a day
-    def hashtag_set(d):
-        hts = set()
-        for i, row in d.iterrows():
-            hts.update(row["hashtags"])
-
-        return pd.Series(
-            {
-                "hashtags": list(hts),
-            }
-        )
+def spill_by_date(input_file, spill_dir, batch_size=1 << 20, cache_dir=None):
+    """
+    stream the parquet cache of tweets.csv in batches of batch_size rows,
+    and spill the author_id and hashtags of every tweet to the partition of
+    its date, spill_dir/<date>/<batch>.parquet
 
-    df = pd.DataFrame(
-        df.groupby(["author_id", "date"], as_index=False).apply(
-            hashtag_set, include_groups=False
+    return: list of the partition directories, sorted by date
+    """
+    reader = pq.ParquetFile(cached_parquet(input_file, cache_dir)).iter_batches(
+        batch_size=batch_size, columns=COLUMNS
+    )
+    dropped_count, kept_count = 0, 0
+    for block, batch in enumerate(reader):
+        df = batch.to_pandas()
+        df["created_at"] = pd.to_datetime(
+            df["created_at"], format="ISO8601", errors="coerce"
         )
+        dropped = df["created_at"].isna()
+        dropped_count += int(dropped.sum())
+        df = df[~dropped]
+        kept_count += len(df)
+
+        for date, day in df.groupby(df["created_at"].dt.date.astype(str)):
+            os.makedirs(join(spill_dir, date), exist_ok=True)
+            day[["author_id", "hashtags"]].to_parquet(
+                join(spill_dir, date, f"{block}.parquet"), index=False
+            )
+
+    print(f"Dropped/Kept rows: {dropped_count}/{kept_count}")
+    if dropped_count > 0:
+        print(f"WARNING: dropped {dropped_count} rows due to missing created_at values")
+    return sorted(join(spill_dir, date) for date in os.listdir(spill_dir))
+
+
+def _process_day(min_num_tweets, min_num_hashtags, partition):
+    """
+    features of the tweets of one date partition, written next to it
+
+    return: number of pairs of each feature id of the partition
+    """
+    df = pd.read_parquet(partition)
+    df["date"] = os.path.basename(partition)
+    pairs, pair_codes, hashtags = hashtag_sets(df, min_num_tweets, min_num_hashtags)
+    pairs["feature"] = feature_ids(pairs["date"].to_numpy(), pair_codes, hashtags)
+    pairs[["author_id", "feature"]].to_parquet(partition + ".edge.parquet", index=False)
+    feature_names(pairs, pair_codes, hashtags).to_parquet(
+        partition + ".names.parquet", index=False
     )
+    return pairs["feature"].value_counts()
+
+
+def process_tweets_streaming(
+    input_file,
+    output,
+    min_num_tweets,
+    min_num_hashtags,
+    n_jobs=1,
+    batch_size=1 << 20,
+    spill_dir=None,
+    cache_dir=None,
+    write_csv=False,
+):
+    """
+    same features as process_tweets, without holding all the tweets in memory
+
+    The tweets are spilled to one partition per date, since features never
+    span two dates. Each date is processed independently by a pool of n_jobs
+    processes; a final pass drops the features with a single pair, from the
+    sum of the counts of every partition.
+
+    The edge parquet has the rows of process_tweets, without its index.
+
+    input:
+        spill_dir : directory of the temporary partitions, the directory of
+            output by default
+    """
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=spill_dir or os.path.dirname(output) or ".")
+    try:
+        partitions = spill_by_date(
+            input_file, tmpdir, batch_size=batch_size, cache_dir=cache_dir
+        )
 
-    #
-    # keep (account, date) pairs with at least the minimum number of hashtags
-    #
-    df["num_hashtags"] = df["hashtags"].apply(lambda x: len(x))
-    df = df[df["num_hashtags"] >= min_num_hashtags].reset_index(drop=True)
-    df.drop(columns=["num_hashtags"], inplace=True)
-
-    #
-    # create the feature data based on date and hashtag sequence
-    #
+        process_day = partial(_process_day, min_num_tweets, min_num_hashtags)
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                counts = list(pool.map(process_day, partitions))
+        else:
+            counts = [process_day(partition) for partition in partitions]
 
-    # create a string representation of the hashtag list
-    df["hashtags"] = df["hashtags"].apply(lambda x: "-".join(x))
+        # drop features that only appear once
+        # appearing once implies that only a single account has the feature
+        counts = pd.concat(counts).groupby(level=0).sum() if counts else pd.Series()
+        kept = counts.index[counts > 1]
 
-    # combine the date and hashtag columns with an underscore
-    # this is the feature column for pacheo case study 3
-    df["feature"] = df["date"].astype(str) + "_" + df["hashtags"]
+        def read_kept(suffix, columns):
+            tables = [pd.read_parquet(p + suffix) for p in partitions]
+            tables = [t[t["feature"].isin(kept)] for t in tables]
+            return pd.concat(tables) if tables else pd.DataFrame(columns=columns)
 
-    # drop features that only appear once
-    # appearing once implies that only a single account has the feature
-    feature_counts = df["feature"].value_counts()
-    df = df[df["feature"].isin(feature_counts[feature_counts > 1].index)]
+        df = read_kept(".edge.parquet", ["author_id", "feature"])
+        names = read_kept(".names.parquet", ["feature", "name"])
+    finally:
+        shutil.rmtree(tmpdir)
 
     # structure to uid, feature, cnt for compatibility with pipeline
-    df = df[["author_id", "feature"]]
+    df = df.rename(columns={"author_id": "uid"})
     df["cnt"] = 1
+    df = df.sort_values(by=["feature", "uid"]).reset_index(drop=True)
+    names = names.drop_duplicates("feature").sort_values("feature")
 
-    # rename author_id to uid
-    df.rename(columns={"author_id": "uid"}, inplace=True)
-
-    # sort by feature column
-    df = df.sort_values(by=["feature", "uid"])
-
-    # save
-
-    df.to_parquet(output)
-    df.to_csv(output.replace(".parquet", ".csv"), index=False)
+    df.to_parquet(output, index=False)
+    if write_csv:
+        df.to_csv(output.replace(".parquet", ".csv"), index=False)
+    names.to_parquet(names_path(output), index=False)
 
 
 if __name__ == "__main__":
@@ -148,7 +372,59 @@ if __name__ == "__main__":
         default=4,
         help="Minimum number of hashtags per (account, day)",
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read the input in blocks and process each day separately, for inputs that do not fit in memory",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of processes working on days, with --streaming",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1 << 20,
+        help="Number of tweets read at a time, with --streaming",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        default=None,
+        help="Directory of the temporary day partitions, with --streaming; the output directory by default",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Directory of the parquet cache of the input; .csvcache next to the input by default",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="Also write a CSV copy of the edges next to the output",
+    )
 
     args = parser.parse_args()
 
-    process_tweets(args.input, args.output, args.min_num_tweets, args.min_num_hashtags)
+    if args.streaming:
+        process_tweets_streaming(
+            args.input,
+            args.output,
+            args.min_num_tweets,
+            args.min_num_hashtags,
+            n_jobs=args.threads,
+            batch_size=args.batch_size,
+            spill_dir=args.spill_dir,
+            cache_dir=args.cache_dir,
+            write_csv=args.csv,
+        )
+    else:
+        process_tweets(
+            args.input,
+            args.output,
+            args.min_num_tweets,
+            args.min_num_hashtags,
+            cache_dir=args.cache_dir,
+            write_csv=args.csv,
+        )
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+from hashlib import blake2b
+from os.path import join
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv
+
+# a raw csv file is converted once to a parquet file of the cache directory,
+# named after the csv file (see cache_name) and the hash of its content, so
+# that a changed csv file gets a new cache file; CACHE_FORMAT is bumped
+# whenever the content of the cache files changes
+CACHE_DIR = ".csvcache"
+CACHE_FORMAT = 2
+
+# columns kept as strings whatever their content looks like: dates are parsed
+# by the consumers, lists are string representations
+STRING_COLUMNS = ["created_at", "hashtags", "text", "author_id", "handle"]
+
+PARSE_OPTIONS = csv.ParseOptions(newlines_in_values=True)
+
+
+def content_hash(path, chunk_bytes=1 << 20):
+    """
+    hex blake2b hash of the bytes of a file
+    """
+    h = blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_name(path):
+    """
+    prefix of the cache files of a csv file: its name and a hash of its
+    absolute path, so that csv files of the same name in different
+    directories can share a cache directory
+    """
+    location = blake2b(os.path.abspath(path).encode(), digest_size=4).hexdigest()
+    return f"{os.path.basename(path)}.{location}"
+
+
+def cached_hash(path, cache_dir):
+    """
+    content_hash of a file, recomputed only if its size or modification
+    time changed since it was last hashed
+
+    The hash is kept with the size and modification time of the file in
+    cache_dir, so that the readers of an unchanged file do not read it all.
+    """
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    stamp = join(cache_dir, f"{cache_name(path)}.hash.json")
+    try:
+        with open(stamp, "r") as f:
+            known = json.load(f)
+        if {key: known[key] for key in signature} == signature:
+            return known["hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = content_hash(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmpfile = f"{stamp}.{os.getpid()}.tmp"
+    with open(tmpfile, "w") as f:
+        json.dump(dict(signature, hash=digest), f)
+    os.replace(tmpfile, stamp)
+    return digest
+
+
+def csv_columns(path):
+    """
+    names of the columns of a csv file, from its header
+    """
+    reader = csv.open_csv(
+        path,
+        read_options=csv.ReadOptions(block_size=1 << 20),
+        parse_options=PARSE_OPTIONS,
+    )
+    names = reader.schema.names
+    reader.close()
+    return names
+
+
+def infer_type(values):
+    """
+    type pandas.read_csv would give a column of strings: int64, then
+    float64, then bool if every value is true or false (in any case), and
+    string otherwise
+
+    input:
+        values : string ChunkedArray of the whole column, nulls for missing
+            values
+    """
+    for target in (pa.int64(), pa.float64()):
+        try:
+            pc.cast(values, target)
+            return target
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    lower = pc.utf8_lower(values)
+    if pc.all(pc.is_in(pc.drop_null(lower), pa.array(["true", "false"]))).as_py():
+        return pa.bool_()
+    return pa.string()
+
+
+def cast_strings(values, target):
+    """
+    cast strings to the type returned by infer_type for their column
+    """
+    if pa.types.is_boolean(target):
+        return pc.equal(pc.utf8_lower(values), "true")
+    return pc.cast(values, target)
+
+
+def convert_csv(path, outfile, block_size=64 << 20, batch_size=1 << 20):
+    """
+    convert a raw csv file to a typed parquet file, block_size bytes at a time
+
+    The streaming csv reader would infer the types from the first block only,
+    and a column that is sparse there fails to convert later on. So the csv
+    file is first written to parquet as strings; the type of each column is
+    then inferred over the whole column, one column at a time (see
+    infer_type), and the strings are cast to it batch_size rows at a time.
+    The STRING_COLUMNS are not inferred. Empty values are nulls, as with
+    pandas.read_csv. The handle column is renamed author_id (unless there is
+    one already). Columns are dictionary-encoded in the parquet file.
+    """
+    names = csv_columns(path)
+    reader = csv.open_csv(
+        path,
+        read_options=csv.ReadOptions(block_size=block_size),
+        parse_options=PARSE_OPTIONS,
+        convert_options=csv.ConvertOptions(
+            column_types={name: pa.string() for name in names},
+            strings_can_be_null=True,
+        ),
+    )
+    if "handle" in names and "author_id" not in names:
+        names = ["author_id" if name == "handle" else name for name in names]
+
+    strings = f"{outfile}.strings"
+    try:
+        schema = pa.schema([(name, pa.string()) for name in names])
+        with pq.ParquetWriter(strings, schema, use_dictionary=True) as writer:
+            for batch in reader:
+                writer.write_batch(batch.rename_columns(names))
+
+        source = pq.ParquetFile(strings)
+        schema = pa.schema(
+            [
+                (
+                    name,
+                    (
+                        pa.string()
+                        if name in STRING_COLUMNS
+                        else infer_type(source.read([name]).column(0))
+                    ),
+                )
+                for name in names
+            ]
+        )
+        with pq.ParquetWriter(outfile, schema, use_dictionary=True) as writer:
+            for batch in source.iter_batches(batch_size=batch_size):
+                writer.write_batch(
+                    pa.record_batch(
+                        [
+                            cast_strings(batch.column(i), field.type)
+                            for i, field in enumerate(schema)
+                        ],
+                        schema=schema,
+                    )
+                )
+    finally:
+        if os.path.exists(strings):
+            os.remove(strings)
+
+
+def cached_parquet(path, cache_dir=None):
+    """
+    path of the parquet cache of a raw csv file, converting the csv file
+    first if it has no cache for its current content
+
+    input:
+        cache_dir : directory of the cache, CACHE_DIR in the directory of
+            path by default
+    """
+    if cache_dir is None:
+        cache_dir = join(os.path.dirname(path) or ".", CACHE_DIR)
+    base = cache_name(path)
+    digest = cached_hash(path, cache_dir)
+    cached = join(cache_dir, f"{base}.{digest}.v{CACHE_FORMAT}.parquet")
+    if os.path.exists(cached):
+        return cached
+
+    # write under a temporary name first, so that concurrent readers never
+    # see a partial cache file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmpfile = f"{cached}.{os.getpid()}.tmp"
+    try:
+        convert_csv(path, tmpfile)
+        os.replace(tmpfile, cached)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+    # cache files of previous contents of the csv file, and the cache files
+    # of the first format, named after the csv file only
+    name = os.path.basename(path)
+    stale = re.compile(
+        rf"{re.escape(base)}\.[0-9a-f]{{32}}\.v[0-9]+\.parquet"
+        rf"|{re.escape(name)}\.[0-9a-f]{{32}}\.parquet"
+    )
+    for other in glob.glob(join(glob.escape(cache_dir), glob.escape(name) + ".*")):
+        if other != cached and stale.fullmatch(os.path.basename(other)):
+            os.remove(other)
+    return cached
+
+
+def read_csv_cached(path, columns=None, cache_dir=None):
+    """
+    read columns of a raw csv file from its parquet cache
+
+    input:
+        columns : list of columns to read, all of them by default
+    return: DataFrame
+    """
+    return pq.read_table(cached_parquet(path, cache_dir), columns=columns).to_pandas()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="convert raw csv files to their parquet cache ahead of the feature rules"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--input",
+        nargs="+",
+        required=True,
+        help="paths to input csv files",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        type=str,
+        help="directory of the cache; .csvcache next to each csv file by default",
+    )
+
+    args = parser.parse_args(args)
+    for path in args.input:
+        print(cached_parquet(path, args.cache_dir))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from os.path import join
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# a graph is a directory holding a node table (node, then node attributes)
+# and an edge list (source, target, then edge attributes)
+NODES = "nodes.parquet"
+EDGES = "edges.parquet"
+
+
+def write_graph(outgraph, nodes, edges, graph_format="parquet"):
+    """
+    write a graph, either as a directory of parquet tables or as GraphML
+
+    input:
+        nodes : DataFrame with a node column and node attributes
+        edges : DataFrame with source and target columns and edge attributes
+    """
+    if graph_format == "parquet":
+        os.makedirs(outgraph, exist_ok=True)
+        nodes.to_parquet(join(outgraph, NODES), index=False)
+        edges.to_parquet(join(outgraph, EDGES), index=False)
+    else:
+        node_batch = pa.RecordBatch.from_pandas(nodes, preserve_index=False)
+        edge_batch = pa.RecordBatch.from_pandas(edges, preserve_index=False)
+        os.makedirs(os.path.dirname(outgraph) or ".", exist_ok=True)
+        with open(outgraph, "w") as f:
+            write_graphml(
+                f, node_batch.schema, [node_batch], edge_batch.schema, [edge_batch]
+            )
+
+
+def touch_graph(outgraph, graph_format="parquet"):
+    # null input -> null output
+    if graph_format == "parquet":
+        os.makedirs(outgraph, exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(outgraph) or ".", exist_ok=True)
+        with open(outgraph, "a") as f:
+            pass
+
+
+def graphml_type(arrow_type):
+    if pa.types.is_boolean(arrow_type):
+        return "boolean"
+    if pa.types.is_integer(arrow_type):
+        return "long"
+    if pa.types.is_floating(arrow_type):
+        return "double"
+    return "string"
+
+
+def graphml_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return escape(str(value))
+
+
+def write_elements(f, tag, batch, id_columns, keys):
+    """
+    write the rows of a record batch as GraphML elements
+
+    input:
+        id_columns : dict { xml attribute : column } of the element ids
+        keys : list of (GraphML key, column) of the element data
+    """
+    ids = [
+        (attr, [quoteattr(str(v)) for v in batch.column(column).to_pylist()])
+        for attr, column in id_columns.items()
+    ]
+    data = [(key, batch.column(column).to_pylist()) for key, column in keys]
+    lines = []
+    for i in range(batch.num_rows):
+        head = " ".join(f"{attr}={values[i]}" for attr, values in ids)
+        values = [
+            f'      <data key="{key}">{graphml_value(column[i])}</data>\n'
+            for key, column in data
+            if column[i] is not None
+        ]
+        if values:
+            lines.append(f"    <{tag} {head}>\n{''.join(values)}    </{tag}>\n")
+        else:
+            lines.append(f"    <{tag} {head} />\n")
+    f.write("".join(lines))
+
+
+def write_graphml(f, node_schema, node_batches, edge_schema, edge_batches):
+    """
+    stream a graph to the text file f as GraphML, one record batch at a time,
+    without building the XML tree
+    """
+    node_keys = [
+        (f"n{i}", field) for i, field in enumerate(node_schema) if field.name != "node"
+    ]
+    edge_keys = [
+        (f"e{i}", field)
+        for i, field in enumerate(edge_schema)
+        if field.name not in ("source", "target")
+    ]
+
+    f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+    f.write(
+        '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+        'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n'
+    )
+    for domain, keys in (("node", node_keys), ("edge", edge_keys)):
+        for key, field in keys:
+            f.write(
+                f'  <key id="{key}" for="{domain}" attr.name={quoteattr(field.name)} '
+                f'attr.type="{graphml_type(field.type)}" />\n'
+            )
+    f.write('  <graph edgedefault="undirected">\n')
+    for batch in node_batches:
+        write_elements(
+            f,
+            "node",
+            batch,
+            {"id": "node"},
+            [(key, field.name) for key, field in node_keys],
+        )
+    for batch in edge_batches:
+        write_elements(
+            f,
+            "edge",
+            batch,
+            {"source": "source", "target": "target"},
+            [(key, field.name) for key, field in edge_keys],
+        )
+    f.write("  </graph>\n</graphml>\n")
+
+
+def is_null_graph(ingraph):
+    return not (
+        os.path.exists(join(ingraph, NODES)) and os.path.exists(join(ingraph, EDGES))
+    )
+
+
+def export_graphml(ingraph, outfile, batch_size=65536):
+    """
+    convert a graph directory to GraphML, reading batch_size rows at a time
+    """
+    nodes = pq.ParquetFile(join(ingraph, NODES))
+    edges = pq.ParquetFile(join(ingraph, EDGES))
+    with open(outfile, "w") as f:
+        write_graphml(
+            f,
+            nodes.schema_arrow,
+            nodes.iter_batches(batch_size),
+            edges.schema_arrow,
+            edges.iter_batches(batch_size),
+        )
+
+
+def load_gt_graph(ingraph):
+    """
+    load a graph directory as a graph_tool Graph; node ids become the vertex
+    property "name", the other columns vertex and edge properties
+    """
+    import graph_tool.all as gt
+
+    nodes = pd.read_parquet(join(ingraph, NODES))
+    edges = pd.read_parquet(join(ingraph, EDGES))
+    index = pd.Index(nodes["node"])
+
+    g = gt.Graph(directed=False)
+    g.add_vertex(len(nodes))
+    g.add_edge_list(
+        np.column_stack(
+            [index.get_indexer(edges["source"]), index.get_indexer(edges["target"])]
+        )
+    )
+
+    g.vp["name"] = g.new_vp("string", vals=nodes["node"].astype(str).tolist())
+    for table, new_property, properties, skip in (
+        (nodes, g.new_vp, g.vp, ["node"]),
+        (edges, g.new_ep, g.ep, ["source", "target"]),
+    ):
+        for column in table.columns.drop(skip):
+            values = table[column]
+            if pd.api.types.is_integer_dtype(values):
+                properties[column] = new_property("int64_t", vals=values.to_numpy())
+            elif pd.api.types.is_numeric_dtype(values):
+                properties[column] = new_property("double", vals=values.to_numpy())
+            else:
+                properties[column] = new_property(
+                    "string", vals=values.astype(str).tolist()
+                )
+    return g
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="export a graph written by tcd.combine to GraphML or graph-tool"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--ingraph",
+        action="store",
+        dest="ingraph",
+        type=str,
+        required=True,
+        help="path to input graph directory",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        dest="outfile",
+        type=str,
+        required=True,
+        help="path to output file: .graphml, or .gt (needs graph_tool)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=65536,
+        type=int,
+        help="number of rows converted to GraphML at a time",
+    )
+
+    args = parser.parse_args(args)
+    ingraph = args.ingraph
+    outfile = args.outfile
+    batch_size = args.batch_size
+
+    os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+    if is_null_graph(ingraph):
+        # null input -> null output
+        with open(outfile, "a") as f:
+            pass
+    elif outfile.endswith(".gt"):
+        load_gt_graph(ingraph).save(outfile)
+    else:
+        export_graphml(ingraph, outfile, batch_size=batch_size)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,11 +1,47 @@
 import argparse
+import glob
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
-from sklearn.metrics import f1_score, precision_score, recall_score, roc_auc_score
+from scipy.sparse import csr_matrix
 
+from tcd.results import path_keys, write_results
 
-def compute_statistics(groups, authors):
+
+def index_authors(authors):
+    """
+    map author ids to integer codes once, and count the authors and the
+    needles of each code (an author_id can appear on several rows)
+
+    The result can be shared by every group file evaluated against the
+    same authors.
+    """
+    labels = authors["is_needle"].astype(int).to_numpy()
+    # author ids are compared as strings, whatever type each edge file and
+    # the authors file gave them
+    codes, author_ids = pd.factorize(
+        authors["author_id"].astype(str), use_na_sentinel=False
+    )
+    return {
+        "author_ids": pd.Index(author_ids),
+        "num_rows": np.bincount(codes, minlength=len(author_ids)),
+        "num_needles": np.bincount(codes, weights=labels, minlength=len(author_ids)),
+        "num_authors": len(labels),
+        "positives": labels.sum(),
+    }
+
+
+def compute_statistics(groups, authors, author_index=None):
+    """
+    input:
+        groups : list of lists of author_ids, or None
+        authors : DataFrame with author_id and is_needle, not needed if
+            author_index is given
+        author_index : output of index_authors(authors)
+    """
     if groups is None:
         summary_stats = {
             "num_groups": 0,
@@ -30,46 +66,150 @@ def compute_statistics(groups, authors):
         }
 
         # groups is a list of lists of author_ids
-        # for each list in groups, add a column to the authors dataframe
-        # the columns will have a zero if the author_id is not in the group
-        # and a one if the author_id is in the group
-        for i, group in enumerate(groups):
-            authors[f"group_{i}"] = authors["author_id"].isin(group).astype(int)
-
-        for i in range(len(groups)):
-            group_name = f"group_{i}"
-            group_labels = authors["is_needle"].astype(int)
-            group_predictions = authors[group_name]
-            # group_labels = authors[group_name]
-            # group_predictions = authors["is_needle"].astype(int)
-
-            precision = precision_score(group_labels, group_predictions)
-            recall = recall_score(group_labels, group_predictions)
-            sensitivity = recall
-            specificity = (group_labels == 0).sum() / (group_labels == 0).count()
-            f1 = f1_score(group_labels, group_predictions)
-            roc_auc = roc_auc_score(group_labels, group_predictions)
-
-            summary_stats["precision"].append(precision)
-            summary_stats["recall"].append(recall)
-            summary_stats["sensitivity"].append(sensitivity)
-            summary_stats["specificity"].append(specificity)
-            summary_stats["f1_score"].append(f1)
-            summary_stats["roc_auc"].append(roc_auc)
+        if author_index is None:
+            author_index = index_authors(authors)
+        author_ids = author_index["author_ids"]
+
+        # sparse group x author_id membership matrix; members that are not
+        # authors are dropped, and repeated members count once
+        members = author_ids.get_indexer(
+            [str(author_id) for group in groups for author_id in group]
+        )
+        group_of = np.repeat(np.arange(len(groups)), [len(g) for g in groups])
+        found = members >= 0
+        membership = csr_matrix(
+            (np.ones(found.sum()), (group_of[found], members[found])),
+            shape=(len(groups), len(author_ids)),
+        )
+        membership.sum_duplicates()
+        membership.data[:] = 1
+
+        # confusion matrix of every group at once, with the group as the
+        # predicted positives
+        predicted, tp = (
+            membership
+            @ np.column_stack([author_index["num_rows"], author_index["num_needles"]])
+        ).T
+        positives = author_index["positives"]
+        negatives = author_index["num_authors"] - positives
+        fp = predicted - tp
+        fn = positives - tp
+        tn = negatives - fp
+
+        if len(groups) > 0 and (positives == 0 or negatives == 0):
+            raise ValueError(
+                "Only one class present in y_true. ROC AUC score is not defined in that case."
+            )
+
+        # metrics as computed by sklearn for binary predictions, 0 when undefined
+        precision = np.divide(
+            tp, predicted, out=np.zeros(len(groups)), where=predicted > 0
+        )
+        recall = tp / positives
+        f1_denominator = 2 * tp + fp + fn
+        f1 = np.divide(
+            2 * tp, f1_denominator, out=np.zeros(len(groups)), where=f1_denominator > 0
+        )
+        # the ROC curve of binary predictions has a single corner
+        roc_auc = (1 + recall - fp / negatives) / 2
+        # share of negative authors, the same for every group
+        specificity = np.full(len(groups), negatives / author_index["num_authors"])
+
+        summary_stats["precision"] = precision.tolist()
+        summary_stats["recall"] = recall.tolist()
+        summary_stats["sensitivity"] = recall.tolist()
+        summary_stats["specificity"] = specificity.tolist()
+        summary_stats["f1_score"] = f1.tolist()
+        summary_stats["roc_auc"] = roc_auc.tolist()
 
     return summary_stats
 
 
-def main(groups, authors, output):
-    # Load the JSON file
-    with open(groups, "r") as f:
+def load_groups(path):
+    with open(path, "r") as f:
         try:
-            groups = json.load(f)
+            return json.load(f)
         except json.JSONDecodeError:
             print(
-                "WARNING: Could not load the JSON file. Probably the group has no statistics."
+                f"WARNING: Could not load the JSON file {path}. Probably the group has no statistics."
             )
-            groups = None
+            return None
+
+
+_worker_state = dict()
+
+
+def _init_worker(author_index):
+    _worker_state["author_index"] = author_index
+
+
+def _evaluate(path):
+    return compute_statistics(
+        load_groups(path), None, author_index=_worker_state["author_index"]
+    )
+
+
+def expand_paths(patterns):
+    """
+    sorted unique paths of the files given as paths or glob patterns; a path
+    or a pattern that matches no file is an error
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            paths.add(pattern)
+            continue
+        matches = glob.glob(pattern, recursive=True)
+        if not matches:
+            raise FileNotFoundError(f"No group file matches {pattern}")
+        paths.update(matches)
+    return sorted(paths)
+
+
+def batch_main(patterns, authors, output, per_file_name=None, n_jobs=1, results=None):
+    """
+    evaluate many group files against the same authors in one process
+
+    input:
+        patterns : list of paths or glob patterns of group files
+        output : path to the JSON file of { group file : statistics }
+        per_file_name : if given, the statistics of each group file are also
+            written to this file name in its directory
+        n_jobs : number of worker processes
+        results : if given, path to the results store the statistics of each
+            group file are written to
+    """
+    paths = expand_paths(patterns)
+    author_index = index_authors(pd.read_parquet(authors))
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker, initargs=(author_index,)
+        ) as pool:
+            all_stats = list(pool.map(_evaluate, paths))
+    else:
+        _init_worker(author_index)
+        all_stats = [_evaluate(path) for path in paths]
+
+    if per_file_name is not None:
+        for path, summary_stats in zip(paths, all_stats):
+            with open(os.path.join(os.path.dirname(path), per_file_name), "w") as f:
+                json.dump(summary_stats, f, indent=4)
+
+    if results is not None:
+        for path, summary_stats in zip(paths, all_stats):
+            write_results(results, summary_stats, **path_keys(path))
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(dict(zip(paths, all_stats)), f, indent=4)
+
+
+def main(groups, authors, output, results=None):
+    group_path = groups
+
+    # Load the JSON file
+    groups = load_groups(groups)
 
     # Load the parquet file
     authors = pd.read_parquet(authors)
@@ -81,18 +221,28 @@ def main(groups, authors, output):
     with open(output, "w") as f:
         json.dump(summary_stats, f, indent=4)
 
+    # Append the statistics to the results store
+    if results is not None:
+        write_results(results, summary_stats, **path_keys(group_path))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compute summary statistics from a JSON file."
     )
-    parser.add_argument(
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument(
         "-g",
         "--groups",
         type=str,
-        required=True,
         help="Path to the input JSON file that lists accounts in each group",
     )
+    inputs.add_argument(
+        "--group-files",
+        nargs="+",
+        type=str,
+        help="Paths or glob patterns (or a mix of both) of many group JSON files, evaluated in one process; -o then gets a JSON file of the statistics of every group file",
+    )
     parser.add_argument(
         "-a",
         "--authors",
@@ -103,6 +253,34 @@ if __name__ == "__main__":
     parser.add_argument(
         "-o", "--output", type=str, required=True, help="Path to the output JSON file"
     )
+    parser.add_argument(
+        "--per-file-name",
+        type=str,
+        default=None,
+        help="With --group-files, also write the statistics of each group file to this file name in its directory",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="With --group-files, number of worker processes",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        default=None,
+        help="Path to the results store (partitioned parquet dataset) to also write the statistics to; the partition is taken from the features/{dataset}/{feature}/{percent}/group.json layout",
+    )
     args = parser.parse_args()
 
-    main(args.groups, args.authors, args.output)
+    if args.group_files is not None:
+        batch_main(
+            args.group_files,
+            args.authors,
+            args.output,
+            per_file_name=args.per_file_name,
+            n_jobs=args.threads,
+            results=args.results,
+        )
+    else:
+        main(args.groups, args.authors, args.output, results=args.results)
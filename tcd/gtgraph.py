@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
 
 from graph_tool.all import *
 
+from tcd.graphio import load_gt_graph
+
 
 def prepare_gt_graph_draw(g):
     comp, hist = label_components(g, directed=False)
@@ -22,7 +25,7 @@ def main(args):
 
     parser.add_argument('-i', '--infile',
         action="store", dest="infile", type=str, required=True,
-        help="path to input pickle file of filtered interaction")
+        help="path to input graph of filtered interaction: a graph directory written by tcd.combine, or a graphml/gt file")
     parser.add_argument('-o', '--outfile',
         action="store", dest="outfile", type=str, required=True,
         help="path to output pdf of the network")
@@ -33,7 +36,7 @@ def main(args):
 
     try:
         # read input
-        g = load_graph(infile)
+        g = load_gt_graph(infile) if os.path.isdir(infile) else load_graph(infile)
         # do work
         param_dict = prepare_gt_graph_draw(g)
         # write output
@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import shutil
+import sys
+from os.path import exists, join
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from tcd.measure import (
+    _topn_per_row,
+    compute_supports,
+    count_matrix,
+    iter_symmetric_topn,
+    load_tfidf_artifact,
+    pairs_to_interactions,
+    save_tfidf_artifact,
+    select_features,
+    smooth_idf,
+    weight_tfidf,
+)
+
+
+def partition_of(user_ids, num_partitions):
+    """
+    interaction partition of every user, from a hash that is stable across
+    processes and runs
+    """
+    return pd.util.hash_array(np.asarray(user_ids, dtype=object)) % num_partitions
+
+
+def write_partitions(
+    interaction_df, outdir, node1_col, num_partitions, partitions=None
+):
+    """
+    write the interactions of the given partitions (all of them if None) as
+    outdir/bucket=<k>/part.parquet, replacing the existing files
+
+    The result is a hive-partitioned parquet dataset that pd.read_parquet
+    reads as a single table.
+    """
+    bucket = partition_of(interaction_df[node1_col], num_partitions)
+    if partitions is None:
+        partitions = range(num_partitions)
+
+    for k in partitions:
+        path = join(outdir, f"bucket={k}")
+        os.makedirs(path, exist_ok=True)
+        interaction_df[bucket == k].to_parquet(
+            join(path, "part.parquet.tmp"), index=False
+        )
+        os.replace(join(path, "part.parquet.tmp"), join(path, "part.parquet"))
+
+
+def read_partitions(indir):
+    interaction_df = pd.read_parquet(indir)
+    return interaction_df.drop(columns=["bucket"])
+
+
+def frozen_tfidf(counts, features, min_df, old_features, old_idf):
+    """
+    tf-idf matrix with the idf of the previous model kept for the features
+    it already had; features entering the vocabulary get their current idf
+
+    return:
+        features : index of the features in the vocabulary
+        idf : array of frozen idf, aligned with features
+        docs_vec : csr matrix of l2-normalized tf-idf vectors
+        is_new : boolean mask of the features that were not in old_features
+        drift : largest relative change between the frozen and the current
+            idf of the old features
+    """
+    keep, doc_freq = select_features(counts, min_df)
+    counts = counts[:, keep]
+    features = features[keep]
+    idf = smooth_idf(doc_freq[keep], counts.shape[0])
+
+    old_pos = old_features.get_indexer(features)
+    is_new = old_pos < 0
+    frozen = np.asarray(old_idf)[old_pos[~is_new]]
+
+    drift = 0.0
+    if len(frozen) > 0:
+        drift = float(np.max(np.abs(idf[~is_new] - frozen) / frozen))
+    idf[~is_new] = frozen
+
+    return features, idf, weight_tfidf(counts, idf), is_new, drift
+
+
+def _full_rows(A, rows, chunk_size):
+    """
+    all non-zero similarities of the given rows of A, chunk by chunk
+
+    return:
+        generator of (rows, cols, sims) arrays, self-similarities excluded
+    """
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start : start + chunk_size]
+        product = (A[chunk] @ A.T).tocoo()
+        r = chunk[product.row]
+        c = product.col.astype(np.int64)
+        keep = (r != c) & (product.data > 0)
+        yield r[keep], c[keep], product.data[keep]
+
+
+def _unordered(rows, cols, sims):
+    """
+    unique unordered pairs (u1 < u2) of directed top-n entries
+    """
+    u1 = np.minimum(rows, cols)
+    u2 = np.maximum(rows, cols)
+    order = np.lexsort((u2, u1))
+    u1, u2, sims = u1[order], u2[order], sims[order]
+    first = np.ones(len(u1), dtype=bool)
+    first[1:] = (u1[1:] != u1[:-1]) | (u2[1:] != u2[:-1])
+    return u1[first], u2[first], sims[first]
+
+
+def update_topn(
+    A,
+    changed,
+    old_u1,
+    old_u2,
+    old_sims,
+    top_n=100,
+    chunk_size=10000,
+    tqdm_desc="updating interaction",
+):
+    """
+    update the symmetric top-n pairs of A (see iter_symmetric_topn) after
+    the rows in changed were modified
+
+    The rows that changed and their previous neighbours are recomputed in
+    full. Every other row keeps its previous top-n list, merged with its
+    new similarities to the changed rows. Only pairs touching a changed row,
+    or a row whose list gained or lost a member, are replaced.
+
+    input:
+        changed : boolean mask of the rows of A whose vectors changed
+        old_u1, old_u2, old_sims : previous pairs, as row indices of A
+
+    return:
+        u1, u2, sims : the affected pairs after the update
+        affected : boolean mask of the rows whose pairs were replaced
+    """
+    n = A.shape[0]
+    # top_n counts the row itself, as in iter_symmetric_topn
+    top_n = top_n - 1
+
+    # previous top-n list of every row
+    old_rows, old_cols, old_top_sims = _topn_per_row(
+        np.concatenate([old_u1, old_u2]),
+        np.concatenate([old_u2, old_u1]),
+        np.concatenate([old_sims, old_sims]),
+        top_n,
+    )
+
+    # rows to recompute: the changed rows and their previous partners
+    recompute = changed.copy()
+    recompute[old_u2[changed[old_u1]]] = True
+    recompute[old_u1[changed[old_u2]]] = True
+
+    recomputed = []
+    offered = []
+    for rows, cols, sims in tqdm(
+        _full_rows(A, np.flatnonzero(recompute), chunk_size),
+        desc=tqdm_desc,
+        total=-(-recompute.sum() // chunk_size),
+    ):
+        recomputed.append(_topn_per_row(rows, cols, sims, top_n))
+        # similarities of changed rows offered to the rows kept as they were
+        to_kept = changed[rows] & ~recompute[cols]
+        offered.append(
+            _topn_per_row(cols[to_kept], rows[to_kept], sims[to_kept], top_n)
+        )
+
+    parts = recomputed
+    merged = np.zeros(n, dtype=bool)
+    if len(offered) > 0:
+        offered = tuple(np.concatenate(a) for a in zip(*offered))
+        merged[offered[0]] = True
+        in_merged = merged[old_rows]
+        parts = parts + [
+            _topn_per_row(
+                np.concatenate([old_rows[in_merged], offered[0]]),
+                np.concatenate([old_cols[in_merged], offered[1]]),
+                np.concatenate([old_top_sims[in_merged], offered[2]]),
+                top_n,
+            )
+        ]
+    new_rows, new_cols, new_sims = (np.concatenate(a) for a in zip(*parts))
+
+    # a row is affected if its vector or the members of its list changed
+    is_candidate = recompute | merged
+    in_candidate = is_candidate[old_rows]
+    old_codes = old_rows[in_candidate] * n + old_cols[in_candidate]
+    new_codes = new_rows * n + new_cols
+    affected = changed.copy()
+    affected[new_rows[~np.isin(new_codes, old_codes)]] = True
+    affected[old_rows[in_candidate][~np.isin(old_codes, new_codes)]] = True
+
+    # new lists of the affected rows, and the lists of the other rows that
+    # point into them; lists that were rebuilt carry the new similarities
+    from_new = affected[new_rows] | affected[new_cols]
+    from_old = ~is_candidate[old_rows] & affected[old_cols]
+    parts = [
+        (new_rows[from_new], new_cols[from_new], new_sims[from_new]),
+        (old_rows[from_old], old_cols[from_old], old_top_sims[from_old]),
+    ]
+
+    rows, cols, sims = (np.concatenate(a) for a in zip(*parts))
+    u1, u2, sims = _unordered(rows, cols, sims)
+    return u1, u2, sims, affected
+
+
+def rebuild(
+    state,
+    edge_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    top_n=100,
+    min_df=3,
+    num_partitions=64,
+    chunk_size=10000,
+    n_jobs=1,
+    executor="process",
+):
+    """
+    compute all interactions from scratch and store them with the tf-idf
+    model in the state directory
+    """
+    user_ids, features, counts = count_matrix(edge_df, p1_col, p2_col, w_col)
+    keep, doc_freq = select_features(counts, min_df)
+    features = features[keep]
+    idf = smooth_idf(doc_freq[keep], counts.shape[0])
+    A = weight_tfidf(counts[:, keep], idf)
+
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    interaction_df = pd.concat(
+        [
+            pairs_to_interactions(
+                u1,
+                u2,
+                sims,
+                user_ids,
+                supports,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+            )
+            for u1, u2, sims in iter_symmetric_topn(
+                A,
+                top_n=top_n,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+                executor=executor,
+            )
+        ],
+        ignore_index=True,
+    )
+
+    shutil.rmtree(join(state, "interactions"), ignore_errors=True)
+    write_partitions(
+        interaction_df, join(state, "interactions"), node1_col, num_partitions
+    )
+    return user_ids, features, idf, A
+
+
+def update(
+    state,
+    edge_df,
+    delta_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    top_n=100,
+    min_df=3,
+    num_partitions=64,
+    idf_tolerance=0.05,
+    chunk_size=10000,
+):
+    """
+    update the interactions in the state directory with the edges of
+    delta_df, which are already summed into edge_df
+
+    return:
+        the new tf-idf model (user_ids, features, idf, docs_vec), or None if
+        the idf drifted more than idf_tolerance and a rebuild is needed
+    """
+    old_user_ids, old_features, old_idf, _ = load_tfidf_artifact(join(state, "tfidf"))
+
+    user_ids, features, counts = count_matrix(edge_df, p1_col, p2_col, w_col)
+    features, idf, A, is_new, drift = frozen_tfidf(
+        counts, features, min_df, old_features, old_idf
+    )
+    print(f"IDF drift: {drift:.4f}")
+    if drift > idf_tolerance:
+        return None
+
+    # rows whose vector changed: users with new edges, and users of features
+    # that entered the vocabulary
+    changed = np.zeros(A.shape[0], dtype=bool)
+    delta_rows = user_ids.get_indexer(delta_df[p1_col].unique())
+    changed[delta_rows[delta_rows >= 0]] = True
+    changed[np.unique(A[:, np.flatnonzero(is_new)].tocoo().row)] = True
+    print(f"Changed users: {changed.sum()}/{A.shape[0]}")
+
+    old_df = read_partitions(join(state, "interactions"))
+    old_u1 = user_ids.get_indexer(old_df[node1_col])
+    old_u2 = user_ids.get_indexer(old_df[node2_col])
+
+    u1, u2, sims, affected = update_topn(
+        A,
+        changed,
+        old_u1,
+        old_u2,
+        old_df[sim_col].to_numpy(),
+        top_n=top_n,
+        chunk_size=chunk_size,
+    )
+
+    # rewrite the partitions holding a removed or an added pair
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+    is_affected = affected[old_u1] | affected[old_u2]
+    new_df = pairs_to_interactions(
+        u1, u2, sims, user_ids, supports, node1_col, node2_col, sim_col, sup_col
+    )
+    kept_df = old_df[~is_affected]
+    kept_df = kept_df.assign(
+        **{
+            sup_col: np.minimum(
+                supports[old_u1[~is_affected]], supports[old_u2[~is_affected]]
+            )
+        }
+    )
+
+    partitions = np.union1d(
+        partition_of(old_df[node1_col][is_affected], num_partitions),
+        partition_of(new_df[node1_col], num_partitions),
+    )
+    kept_df = kept_df[
+        np.isin(partition_of(kept_df[node1_col], num_partitions), partitions)
+    ]
+    print(f"Rewriting partitions: {len(partitions)}/{num_partitions}")
+    write_partitions(
+        pd.concat([kept_df, new_df], ignore_index=True),
+        join(state, "interactions"),
+        node1_col,
+        num_partitions,
+        partitions=partitions,
+    )
+    return user_ids, features, idf, A
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="incrementally update interactions with new edges",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--state",
+        action="store",
+        dest="state",
+        type=str,
+        required=True,
+        help="path to the state directory; the interactions are written to its interactions/ subdirectory",
+    )
+    parser.add_argument(
+        "-d",
+        "--delta",
+        action="store",
+        dest="delta",
+        type=str,
+        required=True,
+        help="path to input parquet file of new edges; if the state does not exist yet, this is the full edge table",
+    )
+    parser.add_argument(
+        "--p1col",
+        action="store",
+        dest="p1col",
+        type=str,
+        required=True,
+        help="column name of nodes in partite 1",
+    )
+    parser.add_argument(
+        "--p2col",
+        action="store",
+        dest="p2col",
+        type=str,
+        required=True,
+        help="column name of nodes in partite 2",
+    )
+    parser.add_argument(
+        "--wcol",
+        action="store",
+        dest="wcol",
+        type=str,
+        required=True,
+        help="column name of edge weights",
+    )
+    parser.add_argument(
+        "--node1",
+        action="store",
+        dest="node1",
+        type=str,
+        required=True,
+        help="column name of node1",
+    )
+    parser.add_argument(
+        "--node2",
+        action="store",
+        dest="node2",
+        type=str,
+        required=True,
+        help="column name of node2",
+    )
+    parser.add_argument(
+        "--sim",
+        action="store",
+        dest="sim",
+        type=str,
+        required=True,
+        help="column name of similarity",
+    )
+    parser.add_argument(
+        "--sup",
+        action="store",
+        dest="sup",
+        type=str,
+        required=True,
+        help="column name of support",
+    )
+    parser.add_argument(
+        "--top-n",
+        action="store",
+        dest="top_n",
+        type=int,
+        default=100,
+        help="size of the top-n list of each node, the node itself included, as in tcd.measure",
+    )
+    parser.add_argument(
+        "--min-df",
+        action="store",
+        dest="min_df",
+        type=int,
+        default=3,
+        help="features used by fewer users than this are ignored",
+    )
+    parser.add_argument(
+        "--num-partitions",
+        action="store",
+        dest="num_partitions",
+        type=int,
+        default=64,
+        help="number of partitions of the interactions, by hash of node1; only used when the state is created",
+    )
+    parser.add_argument(
+        "--idf-tolerance",
+        action="store",
+        dest="idf_tolerance",
+        type=float,
+        default=0.05,
+        help="the idf is frozen between rebuilds; a full rebuild is done when it drifts by more than this relative amount",
+    )
+    parser.add_argument(
+        "--rebuild-every",
+        action="store",
+        dest="rebuild_every",
+        type=int,
+        default=None,
+        help="do a full rebuild after this many incremental updates",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        action="store",
+        dest="chunk_size",
+        type=int,
+        default=10000,
+        help="number of users per block of the similarity product",
+    )
+    parser.add_argument(
+        "--threads",
+        action="store",
+        dest="threads",
+        type=int,
+        default=1,
+        help="number of workers of a full rebuild",
+    )
+    parser.add_argument(
+        "--executor",
+        action="store",
+        dest="executor",
+        type=str,
+        choices=["process", "thread"],
+        default="process",
+        help="kind of worker pool of a full rebuild",
+    )
+
+    args = parser.parse_args(args)
+    state = args.state
+    delta = args.delta
+    p1_col = args.p1col
+    p2_col = args.p2col
+    w_col = args.wcol
+    node1_col = args.node1
+    node2_col = args.node2
+    sim_col = args.sim
+    sup_col = args.sup
+    top_n = args.top_n
+    min_df = args.min_df
+    idf_tolerance = args.idf_tolerance
+    rebuild_every = args.rebuild_every
+    chunk_size = args.chunk_size
+    threads = args.threads
+    executor = args.executor
+
+    meta_path = join(state, "meta.json")
+    if exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    else:
+        meta = {"num_partitions": args.num_partitions, "updates_since_rebuild": None}
+    num_partitions = meta["num_partitions"]
+
+    # read input
+    delta_df = pd.read_parquet(delta)
+    if exists(join(state, "edge.parquet")):
+        edge_df = pd.concat(
+            [pd.read_parquet(join(state, "edge.parquet")), delta_df],
+            ignore_index=True,
+        )
+        edge_df = edge_df.groupby([p1_col, p2_col], as_index=False)[w_col].sum()
+    else:
+        edge_df = delta_df
+    os.makedirs(state, exist_ok=True)
+
+    # do work
+    model = None
+    updates = meta["updates_since_rebuild"]
+    if updates is not None and (rebuild_every is None or updates + 1 < rebuild_every):
+        model = update(
+            state,
+            edge_df,
+            delta_df,
+            p1_col,
+            p2_col,
+            w_col,
+            node1_col,
+            node2_col,
+            sim_col,
+            sup_col,
+            top_n=top_n,
+            min_df=min_df,
+            num_partitions=num_partitions,
+            idf_tolerance=idf_tolerance,
+            chunk_size=chunk_size,
+        )
+        meta["updates_since_rebuild"] = updates + 1
+    if model is None:
+        print("Rebuilding all interactions")
+        model = rebuild(
+            state,
+            edge_df,
+            p1_col,
+            p2_col,
+            w_col,
+            node1_col,
+            node2_col,
+            sim_col,
+            sup_col,
+            top_n=top_n,
+            min_df=min_df,
+            num_partitions=num_partitions,
+            chunk_size=chunk_size,
+            n_jobs=threads,
+            executor=executor,
+        )
+        meta["updates_since_rebuild"] = 0
+
+    # write output
+    save_tfidf_artifact(join(state, "tfidf.new"), *model)
+    shutil.rmtree(join(state, "tfidf"), ignore_errors=True)
+    os.rename(join(state, "tfidf.new"), join(state, "tfidf"))
+
+    edge_df.to_parquet(join(state, "edge.parquet.tmp"), index=False)
+    os.replace(join(state, "edge.parquet.tmp"), join(state, "edge.parquet"))
+
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,34 +1,124 @@
 #!/usr/bin/env python3
 import argparse
-import pickle
+import os
+import shutil
 import sys
+import tempfile
+from os.path import join
 
-import ujson as json
-from tqdm import tqdm
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
+# an index is a directory of two uncompressed arrow ipc files: the tweets
+# sorted by user id, and the offsets of the tweets of each user
+TWEETS = 'tweets.arrow'
+USERS = 'users.arrow'
 
-def prepare_content(in_fp, tqdm_desc="parse user tweet", tqdm_total=None):
-    user_tweets = dict()
 
-    for line in tqdm(in_fp, desc=tqdm_desc, total=tqdm_total):
-        try:
-            twt = json.loads(line)
-        except Exception as e:
-            print(line)
-            raise e
-
-        user_id = twt['user_id']
-
-        target = user_tweets.get(user_id, list())
-        target.append(
-            (
-                twt['created_at'],
-                twt['text']
-            )
+def build_index(tweet_table, outdir):
+    """
+    write the index of a table of tweets (user_id, created_at, text)
+
+    The tweets are sorted by user id, keeping their input order within a
+    user; the users table holds each user id with the [start, stop) rows of
+    its tweets.
+    """
+    tweet_table = tweet_table.select(['user_id', 'created_at', 'text'])
+    order = pc.sort_indices(
+        tweet_table.append_column('row', pa.array(np.arange(tweet_table.num_rows))),
+        sort_keys=[('user_id', 'ascending'), ('row', 'ascending')],
+    )
+    tweet_table = tweet_table.take(order).combine_chunks()
+
+    # the tweets of a user are a run of equal user ids
+    user_ids = tweet_table['user_id']
+    starts = np.flatnonzero(
+        pc.not_equal(user_ids[1:], user_ids[:-1]).to_numpy(zero_copy_only=False)
+    ) + 1
+    starts = np.concatenate([[0], starts]) if tweet_table.num_rows > 0 else starts
+    stops = np.append(starts[1:], tweet_table.num_rows)[:len(starts)]
+    users = pa.table({
+        'user_id': user_ids.take(starts),
+        'start': starts,
+        'stop': stops,
+    })
+
+    # write to a temporary directory first, so that a reader never sees a
+    # partial index
+    os.makedirs(os.path.dirname(os.path.abspath(outdir)), exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(outdir)))
+    for table, name in ((tweet_table, TWEETS), (users, USERS)):
+        with pa.OSFile(join(tmpdir, name), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.rename(tmpdir, outdir)
+
+
+class TweetIndex:
+    """
+    memory-mapped index of the tweets of each user
+
+    Only the user ids are read into memory; the tweets of a user are found
+    by binary search and returned as zero-copy slices of the mapped file.
+
+    usage:
+        index = TweetIndex(path)
+        index.slice(user_id)  # arrow table of created_at, text
+        index[user_id]        # list of (created_at, text), like the pickle
+    """
+
+    def __init__(self, path):
+        self.tweets = pa.ipc.open_file(pa.memory_map(join(path, TWEETS))).read_all()
+        users = pa.ipc.open_file(pa.memory_map(join(path, USERS))).read_all()
+        self.user_ids = users['user_id'].to_numpy(zero_copy_only=False)
+        self.starts = users['start'].to_numpy()
+        self.stops = users['stop'].to_numpy()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _position(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return i
+        return None
+
+    def __contains__(self, user_id):
+        return self._position(user_id) is not None
+
+    def slice(self, user_id):
+        """
+        return: arrow table of created_at and text of the tweets of user_id,
+            empty if the user has none
+        """
+        i = self._position(user_id)
+        if i is None:
+            return self.tweets.slice(0, 0).select(['created_at', 'text'])
+        start = self.starts[i]
+        return self.tweets.slice(start, self.stops[i] - start).select(['created_at', 'text'])
+
+    def lookup(self, user_ids):
+        """
+        return: arrow table of user_id, created_at and text of the tweets of
+            all user_ids, made of zero-copy slices; unknown users are skipped
+        """
+        positions = [i for i in map(self._position, user_ids) if i is not None]
+        return pa.concat_tables(
+            [self.tweets.slice(0, 0)]
+            + [self.tweets.slice(self.starts[i], self.stops[i] - self.starts[i]) for i in positions]
         )
-        user_tweets[user_id] = target
 
-    return user_tweets
+    def __getitem__(self, user_id):
+        if user_id not in self:
+            raise KeyError(user_id)
+        tweets = self.slice(user_id)
+        return list(zip(tweets['created_at'].to_pylist(), tweets['text'].to_pylist()))
+
+    def get(self, user_id, default=None):
+        return self[user_id] if user_id in self else default
 
 
 def main(args):
@@ -38,26 +128,36 @@ def main(args):
 
     parser.add_argument('-i', '--infile',
         action="store", dest="infile", type=str, required=True,
-        help="path to input parquet file of edge table")
+        help="path to input raw tweet file (json lines, optionally gzipped), or to the tweets.parquet written by tcd.ingest")
     parser.add_argument('-o', '--outfile',
         action="store", dest="outfile", type=str, required=True,
-        help="path to output pickle file of tweet table")
-    parser.add_argument('-n', '--numline',
-        action="store", dest="numline", type=int, required=True,
-        help="number of lines in the input file")
+        help="path to output index directory of the tweet table")
+    parser.add_argument('--threads',
+        action="store", dest="threads", type=int, default=1,
+        help="number of processes parsing a raw input file")
 
     args = parser.parse_args(args)
     infile = args.infile
     outfile = args.outfile
-    numline = args.numline
+    threads = args.threads
 
     # read input
-    with open(infile, 'rb') as in_fp:
-        # do work
-        user_tweets = prepare_content(in_fp, tqdm_total=numline)
-    with open(outfile, 'wb') as out_fp:
-        # write output
-        pickle.dump(user_tweets, out_fp)
+    if infile.endswith('.parquet'):
+        tweet_table = pq.read_table(infile)
+    else:
+        # the ingestion stack is only needed for raw input, and would
+        # otherwise be loaded by every reader of the index
+        from tcd.ingest import ingest
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ingest(infile, tmpdir, [('index', {})], n_jobs=threads, tqdm_desc="parse user tweet")
+            tweet_table = pq.read_table(join(tmpdir, 'tweets.parquet'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    # do work and write output
+    build_index(tweet_table, outfile)
 
 
 
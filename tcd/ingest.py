@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+from datetime import datetime
+from functools import partial
+from os.path import join
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import ujson as json
+from tqdm import tqdm
+
+from tcd.create_pacheco_edges_v2 import feature_ids, feature_names, names_path
+from tcd.parser import EdgeAccumulator, _map_chunks, iter_chunks, open_raw
+
+
+class HashtagExtractor:
+    """
+    counts of the values of a list field of the tweets (hashtags or
+    selected_hashtags) per user, as an edge table
+    """
+
+    def __init__(self, field, p1_col="uid", p2_col="feature", w_col="cnt"):
+        self.field = field
+        self.columns = (p1_col, p2_col, w_col)
+        self.edges = EdgeAccumulator()
+
+    def add(self, twt):
+        self.edges.add(twt["user_id"], twt[self.field])
+
+    def result(self):
+        return self.edges
+
+    def open(self, outfile):
+        self.outfile = outfile
+
+    def merge(self, result):
+        self.edges.merge(result)
+
+    def close(self):
+        pq.write_table(self.edges.to_table(*self.columns), self.outfile)
+
+
+class PachecoExtractor:
+    """
+    Pacheco et al. case study 3 features, as in tcd.create_pacheco_edges_v2:
+    the date and set of hashtags of every (account, day) with at least
+    min_num_tweets tweets and min_num_hashtags unique hashtags, kept if more
+    than one account shares them
+
+    Features are the same 64-bit ids, with the same side table of names.
+    Tweets whose created_at cannot be parsed are dropped.
+    """
+
+    def __init__(
+        self,
+        min_num_tweets=3,
+        min_num_hashtags=4,
+        p1_col="uid",
+        p2_col="feature",
+        w_col="cnt",
+    ):
+        self.min_num_tweets = min_num_tweets
+        self.min_num_hashtags = min_num_hashtags
+        self.columns = (p1_col, p2_col, w_col)
+        # number of tweets of each (account, date)
+        self.tweets = EdgeAccumulator()
+        # hashtags of each (account, date)
+        self.hashtags = EdgeAccumulator()
+
+    def add(self, twt):
+        try:
+            date = datetime.fromisoformat(twt["created_at"]).date().isoformat()
+        except (TypeError, ValueError):
+            return
+        user_id = twt["user_id"]
+        self.tweets.add(user_id, [date])
+        self.hashtags.add(
+            (user_id, date),
+            [ht for ht in twt["hashtags"] if ht not in {"", " ", None}],
+        )
+
+    def result(self):
+        return self.tweets, self.hashtags
+
+    def open(self, outfile):
+        self.outfile = outfile
+
+    def merge(self, result):
+        tweets, hashtags = result
+        self.tweets.merge(tweets)
+        self.hashtags.merge(hashtags)
+
+    def features(self):
+        """
+        return: edge table of p1_col, p2_col (64-bit feature ids), w_col, and
+            the table of feature names, as tcd.create_pacheco_edges_v2
+        """
+        p1_col, p2_col, w_col = self.columns
+
+        # (account, date) pairs with at least the minimum number of tweets
+        users, dates, user_codes, date_codes, num_tweets = self.tweets.pairs()
+        active = num_tweets >= self.min_num_tweets
+        active = pd.MultiIndex.from_arrays(
+            [
+                np.array(users, dtype=object)[user_codes[active]],
+                np.array(dates, dtype=object)[date_codes[active]],
+            ]
+        )
+
+        # hashtag sets of those pairs with at least the minimum number of hashtags
+        keys, hashtags, key_codes, hashtag_codes, _ = self.hashtags.pairs()
+        keys = (
+            pd.MultiIndex.from_tuples(keys, names=[p1_col, "date"])
+            if len(keys) > 0
+            else pd.MultiIndex.from_arrays([[], []], names=[p1_col, "date"])
+        )
+        df = pd.DataFrame(
+            {
+                "key": key_codes,
+                "hashtag": np.array(hashtags, dtype=object)[hashtag_codes],
+            }
+        )
+        if len(df) > 0:
+            df = df[keys.isin(active)[df["key"].to_numpy()]]
+        df = df[df.groupby("key")["key"].transform("size") >= self.min_num_hashtags]
+
+        pair_codes, pair_keys = pd.factorize(df["key"], sort=True)
+        pairs = keys[pair_keys].to_frame(index=False)
+        hashtags = df["hashtag"].to_numpy()
+        pairs["feature"] = feature_ids(pairs["date"].to_numpy(), pair_codes, hashtags)
+
+        # drop features that only appear once
+        # appearing once implies that only a single account has the feature
+        pairs = pairs[pairs.groupby("feature")["feature"].transform("size") > 1]
+        names = feature_names(pairs, pair_codes, hashtags)
+
+        df = pairs[[p1_col, "feature"]].rename(columns={"feature": p2_col})
+        df[w_col] = 1
+        return df.sort_values(by=[p2_col, p1_col]).reset_index(drop=True), names
+
+    def close(self):
+        edges, names = self.features()
+        edges.to_parquet(self.outfile, index=False)
+        names.to_parquet(names_path(self.outfile), index=False)
+
+
+class IndexExtractor:
+    """
+    user_id, created_at and text of every tweet, streamed to parquet in
+    input order
+    """
+
+    fields = ["user_id", "created_at", "text"]
+
+    def __init__(self):
+        self.rows = {field: [] for field in self.fields}
+        self.writer = None
+
+    def add(self, twt):
+        for field, values in self.rows.items():
+            values.append(twt[field])
+
+    def result(self):
+        return pa.table(self.rows)
+
+    def open(self, outfile):
+        self.outfile = outfile
+
+    def merge(self, result):
+        if result.num_rows == 0:
+            return
+        if self.writer is None:
+            self.schema = result.schema
+            self.writer = pq.ParquetWriter(self.outfile, self.schema)
+        self.writer.write_table(result.cast(self.schema))
+
+    def close(self):
+        if self.writer is None:
+            pq.write_table(
+                pa.table({field: pa.array([], pa.string()) for field in self.fields}),
+                self.outfile,
+            )
+        else:
+            self.writer.close()
+
+
+# extractor name -> (factory, output file name, names of the options it takes)
+EXTRACTORS = {
+    "hashtags": (
+        partial(HashtagExtractor, "hashtags"),
+        "hashtags.edge.parquet",
+        ["p1_col", "p2_col", "w_col"],
+    ),
+    "selected_hashtags": (
+        partial(HashtagExtractor, "selected_hashtags"),
+        "selected_hashtags.edge.parquet",
+        ["p1_col", "p2_col", "w_col"],
+    ),
+    "pacheco_cs3": (
+        PachecoExtractor,
+        "pacheco_cs3.edge.parquet",
+        ["min_num_tweets", "min_num_hashtags", "p1_col", "p2_col", "w_col"],
+    ),
+    "index": (IndexExtractor, "tweets.parquet", []),
+}
+
+
+def make_extractors(specs):
+    """
+    input:
+        specs : list of (extractor name, dict of options)
+    """
+    return [EXTRACTORS[name][0](**options) for name, options in specs]
+
+
+def _extract_chunk(specs, chunk):
+    extractors = make_extractors(specs)
+    for line in chunk.splitlines():
+        try:
+            twt = json.loads(line)
+        except Exception as e:
+            print(line)
+            raise e
+        for extractor in extractors:
+            extractor.add(twt)
+    return [extractor.result() for extractor in extractors]
+
+
+def ingest(
+    infile,
+    outdir,
+    specs,
+    n_jobs=1,
+    chunk_bytes=64 << 20,
+    tqdm_desc="ingest raw content",
+):
+    """
+    read every tweet of a raw tweet file once, and feed it to each of the
+    extractors of specs; each extractor writes its own output in outdir
+
+    The chunks of lines are parsed in a pool of n_jobs processes, each with
+    its own extractors, whose partial results are merged in input order.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    extractors = make_extractors(specs)
+    for extractor, (name, _) in zip(extractors, specs):
+        extractor.open(join(outdir, EXTRACTORS[name][1]))
+
+    stream, raw = open_raw(infile)
+    with raw, stream, tqdm(
+        total=os.path.getsize(infile), desc=tqdm_desc, unit="B", unit_scale=True
+    ) as progress:
+        chunks = ((chunk, raw.tell()) for chunk in iter_chunks(stream, chunk_bytes))
+        done = 0
+        for results, position in _map_chunks(
+            partial(_extract_chunk, specs), chunks, n_jobs
+        ):
+            for extractor, result in zip(extractors, results):
+                extractor.merge(result)
+            progress.update(position - done)
+            done = position
+
+    for extractor in extractors:
+        extractor.close()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="parse a raw tweet file once into edge tables of several dimensions and a tweet table"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--infile",
+        action="store",
+        dest="infile",
+        type=str,
+        required=True,
+        help="path to input raw tweet file (json lines, optionally gzipped)",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        dest="outdir",
+        type=str,
+        required=True,
+        help="path to output directory; each extractor writes its own parquet file there",
+    )
+    parser.add_argument(
+        "-e",
+        "--extractors",
+        nargs="+",
+        default=list(EXTRACTORS),
+        choices=list(EXTRACTORS),
+        help="extractors to run on every tweet",
+    )
+    parser.add_argument(
+        "--p1col", default="uid", type=str, help="column name of nodes in partite 1"
+    )
+    parser.add_argument(
+        "--p2col", default="feature", type=str, help="column name of nodes in partite 2"
+    )
+    parser.add_argument(
+        "--wcol", default="cnt", type=str, help="column name of edge weights"
+    )
+    parser.add_argument(
+        "--min-num-tweets",
+        type=int,
+        default=3,
+        help="pacheco_cs3: minimum number of tweets per (account, day)",
+    )
+    parser.add_argument(
+        "--min-num-hashtags",
+        type=int,
+        default=4,
+        help="pacheco_cs3: minimum number of hashtags per (account, day)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="number of processes parsing the input"
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        type=int,
+        default=64 << 20,
+        help="number of decompressed bytes parsed at a time by a process",
+    )
+
+    args = parser.parse_args(args)
+    options = {
+        "p1_col": args.p1col,
+        "p2_col": args.p2col,
+        "w_col": args.wcol,
+        "min_num_tweets": args.min_num_tweets,
+        "min_num_hashtags": args.min_num_hashtags,
+    }
+    specs = [
+        (name, {key: options[key] for key in EXTRACTORS[name][2]})
+        for name in dict.fromkeys(args.extractors)
+    ]
+
+    ingest(
+        args.infile,
+        args.outdir,
+        specs,
+        n_jobs=args.threads,
+        chunk_bytes=args.chunk_bytes,
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
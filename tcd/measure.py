@@ -1,30 +1,266 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import json
+import os
+import shutil
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from os.path import join
 
 import numpy as np
 import pandas as pd
-from scipy.sparse import csr_matrix
-from sklearn.feature_extraction.text import TfidfVectorizer
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy.sparse import coo_matrix, csr_matrix
+from sklearn.preprocessing import normalize
 from sparse_dot_topn import sp_matmul_topn
+from tqdm import tqdm
 
 
-def dummy_func(doc):
-    return doc
+def count_matrix(edge_df, p1_col, p2_col, w_col):
+    """
+    user x feature count matrix built from the integer codes of p1 and p2
+
+    Only p1 nodes with more than one edge get a row. Duplicated (p1, p2)
+    pairs are summed up.
+
+    return:
+        user_ids : index of p1 nodes, aligned with the rows of the matrix
+        features : index of p2 nodes, aligned with the columns of the matrix
+        counts : csr matrix of counts
+    """
+    num_edges = edge_df.groupby(p1_col)[p1_col].transform("size")
+    edge_df = edge_df[(num_edges > 1) & edge_df[p2_col].notna()]
+
+    user_codes, user_ids = pd.factorize(edge_df[p1_col], sort=True)
+    feature_codes, features = pd.factorize(edge_df[p2_col], sort=True)
+
+    counts = coo_matrix(
+        (edge_df[w_col].to_numpy(dtype=np.float64), (user_codes, feature_codes)),
+        shape=(len(user_ids), len(features)),
+    ).tocsr()
+    counts.eliminate_zeros()
+
+    return user_ids, features, counts
+
+
+def select_features(counts, min_df):
+    """
+    features used by at least min_df rows, or by at least one row if no
+    feature is used that often
+
+    return:
+        keep : boolean mask of the columns of counts
+        doc_freq : document frequency of every column of counts
+    """
+    doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+    keep = doc_freq >= min_df
+    if not keep.any():
+        keep = doc_freq >= 1
+    return keep, doc_freq
+
+
+def smooth_idf(doc_freq, num_docs):
+    return np.log((1 + num_docs) / (1 + doc_freq)) + 1
+
+
+def weight_tfidf(counts, idf):
+    """
+    l2-normalized sublinear tf-idf vectors of the rows of counts
+    """
+    docs_vec = csr_matrix(counts, copy=True)
+    docs_vec.data = (1 + np.log(docs_vec.data)) * idf[docs_vec.indices]
+    return csr_matrix(normalize(docs_vec, norm="l2", copy=False))
+
+
+def fit_tfidf(edge_df, p1_col, p2_col, w_col, min_df=3):
+    """
+    fit the tf-idf model on the documents of nodes in partition 1
+
+    The count matrix is built directly from the integer codes of p1 and p2
+    (see count_matrix), then weighted like sklearn's
+    TfidfVectorizer(sublinear_tf=True, smooth_idf=True, norm="l2"). If no
+    feature is shared by min_df documents, min_df falls back to 1.
+
+    return:
+        user_ids : index of p1 nodes, aligned with the rows of the matrix
+        features : index of p2 nodes, aligned with the columns of the matrix
+        idf : array of inverse document frequencies, aligned with features
+        docs_vec : csr matrix of l2-normalized tf-idf vectors
+    """
+    user_ids, features, counts = count_matrix(edge_df, p1_col, p2_col, w_col)
+
+    keep, doc_freq = select_features(counts, min_df)
+    counts = counts[:, keep]
+    idf = smooth_idf(doc_freq[keep], counts.shape[0])
+
+    return user_ids, features[keep], idf, weight_tfidf(counts, idf)
+
+
+def tfidf_cache_key(infile, p1_col, p2_col, w_col, min_df):
+    """
+    content hash of the edge file and the parameters of the tf-idf model
+    """
+    digest = hashlib.sha256()
+    with open(infile, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(
+        json.dumps(
+            {"p1_col": p1_col, "p2_col": p2_col, "w_col": w_col, "min_df": min_df}
+        ).encode()
+    )
+    return digest.hexdigest()
+
+
+def save_tfidf_artifact(path, user_ids, features, idf, docs_vec):
+    """
+    persist a fitted tf-idf model into the directory path
+
+    The arrays of the csr matrix and the idf vector are stored as .npy files
+    so they can be memory-mapped, the user index and vocabulary as parquet.
+    The directory is written under a temporary name and renamed at the end,
+    so a partially written artifact is never picked up.
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    np.save(join(tmp_path, "data.npy"), docs_vec.data)
+    np.save(join(tmp_path, "indices.npy"), docs_vec.indices)
+    np.save(join(tmp_path, "indptr.npy"), docs_vec.indptr)
+    np.save(join(tmp_path, "shape.npy"), np.array(docs_vec.shape))
+    np.save(join(tmp_path, "idf.npy"), idf)
+    pd.DataFrame({"user_id": user_ids}).to_parquet(join(tmp_path, "users.parquet"))
+    pd.DataFrame({"feature": features}).to_parquet(join(tmp_path, "features.parquet"))
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another run stored the same artifact first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_tfidf_artifact(path):
+    """
+    load a tf-idf model stored by save_tfidf_artifact, memory-mapping the
+    arrays copy-on-write since the matmul kernels need writable buffers
+
+    return:
+        user_ids, features, idf, docs_vec : as returned by fit_tfidf
+    """
+    user_ids = pd.Index(pd.read_parquet(join(path, "users.parquet"))["user_id"])
+    features = pd.Index(pd.read_parquet(join(path, "features.parquet"))["feature"])
+    idf = np.load(join(path, "idf.npy"), mmap_mode="c")
+    docs_vec = csr_matrix(
+        (
+            np.load(join(path, "data.npy"), mmap_mode="c"),
+            np.load(join(path, "indices.npy"), mmap_mode="c"),
+            np.load(join(path, "indptr.npy"), mmap_mode="c"),
+        ),
+        shape=tuple(np.load(join(path, "shape.npy"))),
+        copy=False,
+    )
+    return user_ids, features, idf, docs_vec
+
+
+def build_tfidf_matrix(edge_df, p1_col, p2_col, w_col, min_df=3, cache_path=None):
+    """
+    tf-idf matrix of the nodes in partition 1 (see fit_tfidf)
+
+    input:
+        cache_path : directory of the persisted model, see tfidf_cache_key.
+            It is loaded if it exists, and written after fitting otherwise.
+            If None, the model is always fitted.
+
+    return:
+        user_ids : index of p1 nodes, aligned with the rows of the matrix
+        docs_vec : csr matrix of l2-normalized tf-idf vectors
+    """
+    if cache_path is not None and os.path.isdir(cache_path):
+        print("Loading tf-idf matrix from", cache_path)
+        user_ids, _, _, docs_vec = load_tfidf_artifact(cache_path)
+        return user_ids, docs_vec
+
+    user_ids, features, idf, docs_vec = fit_tfidf(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df
+    )
+    if cache_path is not None:
+        save_tfidf_artifact(cache_path, user_ids, features, idf, docs_vec)
+    return user_ids, docs_vec
+
+
+def compute_supports(edge_df, p1_col, w_col, user_ids):
+    """
+    number of tweets/retweets of each p1 node, aligned with user_ids
+    """
+    return edge_df.groupby(p1_col)[w_col].sum().reindex(user_ids).to_numpy()
+
+
+def topn_to_interactions(
+    results,
+    user_ids,
+    supports,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    row_offset=0,
+):
+    """
+    convert a top-n similarity matrix into an interaction table
 
+    input:
+        results : csr matrix whose row i holds the neighbours of user
+            row_offset + i
+        user_ids : index of p1 nodes, aligned with the rows of the matrix
+        supports : array of supports, aligned with user_ids
+        row_offset : global index of the first row in results
+    """
+    u1_idx = np.repeat(
+        np.arange(row_offset, row_offset + results.shape[0]),
+        np.diff(results.indptr),
+    )
+    u2_idx = results.indices
 
-class DocConverter(object):
-    def __init__(self):
-        self._p1_idx_map = None
+    mask = u1_idx < u2_idx
 
-    def edge2doc(self, edge_df, p1_col, p2_col, w_col):
-        self._p1_idx_map = dict()
-        idx = 0
-        for p1_node, grp in edge_df.groupby(p1_col):
-            self._p1_idx_map[p1_node] = idx
-            idx += 1
-            yield grp[p2_col].repeat(grp[w_col]).values
-        raise StopIteration
+    return pairs_to_interactions(
+        u1_idx[mask],
+        u2_idx[mask],
+        results.data[mask],
+        user_ids,
+        supports,
+        node1_col,
+        node2_col,
+        sim_col,
+        sup_col,
+    )
+
+
+def pairs_to_interactions(
+    u1_idx,
+    u2_idx,
+    sims,
+    user_ids,
+    supports,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+):
+    """
+    convert arrays of row indices and similarities into an interaction table
+    """
+    return pd.DataFrame(
+        {
+            node1_col: user_ids.take(u1_idx),
+            node2_col: user_ids.take(u2_idx),
+            sim_col: sims,
+            sup_col: np.minimum(supports[u1_idx], supports[u2_idx]),
+        }
+    )
 
 
 def calculate_interaction(
@@ -36,6 +272,10 @@ def calculate_interaction(
     node2_col,
     sim_col,
     sup_col,
+    top_n=100,
+    min_similarity=None,
+    min_df=3,
+    cache_path=None,
     tqdm_total=None,
     tqdm_desc="calculating interaction",
 ):
@@ -47,6 +287,10 @@ def calculate_interaction(
         p1_col : column name that represent p1
         p2_col : column name that represent p2
         w_col : column name that represent weight, if None it's unweighted
+        top_n : size of the top-n list of each node, its self match included
+        min_similarity : only similarities greater than this are kept
+        min_df : minimum number of documents a feature must appear in
+        cache_path : directory of the persisted tf-idf model, if any
 
     return:
         interactions : dict { (p1_node1, p1_node2) : interaction_weight }
@@ -55,66 +299,727 @@ def calculate_interaction(
         1. non-empty inputs: edge_df
         2. p1_node1 < p1_node2 holds for the tuples in interactions
     """
-    user_ids, docs = zip(
-        *(
-            (p1_node, grp[p2_col].repeat(grp[w_col]).values)
-            for p1_node, grp in edge_df.groupby(p1_col)
-            if len(grp) > 1
-        )
+    user_ids, A = build_tfidf_matrix(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df, cache_path=cache_path
     )
+    B = csr_matrix(A.T)
 
-    try:
-        tfidf = TfidfVectorizer(
-            analyzer="word",
-            tokenizer=dummy_func,
-            preprocessor=dummy_func,
-            use_idf=True,
-            token_pattern=None,
-            lowercase=False,
-            sublinear_tf=True,
-            min_df=3,
-        )
-        docs_vec = tfidf.fit_transform(docs)
-    except ValueError:
-        tfidf = TfidfVectorizer(
-            analyzer="word",
-            tokenizer=dummy_func,
-            preprocessor=dummy_func,
-            use_idf=True,
-            token_pattern=None,
-            lowercase=False,
-            sublinear_tf=True,
-            min_df=1,
+    results = sp_matmul_topn(A, B, top_n=top_n, threshold=min_similarity)
+
+    # number of tweets/retweets as support
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    return topn_to_interactions(
+        results, user_ids, supports, node1_col, node2_col, sim_col, sup_col
+    )
+
+
+# state shared with the workers of the blocked engine, set once per worker
+# so that B is not pickled along with every chunk of A
+_worker_state = dict()
+
+
+def _init_topn_worker(B, top_n, min_similarity):
+    _worker_state["B"] = B
+    _worker_state["top_n"] = top_n
+    _worker_state["min_similarity"] = min_similarity
+
+
+def _topn_chunk(A_chunk):
+    return sp_matmul_topn(
+        A_chunk,
+        _worker_state["B"],
+        top_n=_worker_state["top_n"],
+        threshold=_worker_state["min_similarity"],
+    )
+
+
+def _make_pool(executor, n_jobs, initializer, initargs):
+    """
+    pool of n_jobs workers whose shared state is set by initializer
+    """
+    if executor == "process":
+        return ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=initializer, initargs=initargs
         )
-        docs_vec = tfidf.fit_transform(docs)
+    elif executor == "thread":
+        initializer(*initargs)
+        return ThreadPoolExecutor(max_workers=n_jobs)
+    else:
+        raise ValueError(f"unknown executor: {executor}")
+
+
+def _bounded_map(executor, func, items, max_pending):
+    """
+    like executor.map, but keeps at most max_pending tasks in flight so that
+    finished chunks are consumed before new ones are produced
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_interaction_blocks(
+    edge_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    top_n=100,
+    min_similarity=None,
+    chunk_size=10000,
+    n_jobs=1,
+    executor="process",
+    tqdm_desc="calculating interaction",
+    min_df=3,
+    cache_path=None,
+):
+    """
+    calculate interactions between nodes in partition 1, block by block
 
-    A = csr_matrix(docs_vec)
-    B = csr_matrix(docs_vec.T)
+    The rows of the tf-idf matrix are split into chunks of chunk_size users
+    and the top-n product of each chunk is computed in a pool of n_jobs
+    workers. Blocks of the interaction table are yielded in row order, so
+    the concatenated output equals the one of calculate_interaction.
 
-    results = sp_matmul_topn(A, B, top_n=100)
+    input:
+        chunk_size : number of rows of A per block
+        n_jobs : number of workers
+        executor : "process" or "thread"
+    """
+    user_ids, A = build_tfidf_matrix(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df, cache_path=cache_path
+    )
+    B = csr_matrix(A.T)
 
     # number of tweets/retweets as support
-    supports = edge_df.groupby(p1_col)[w_col].sum().to_dict()
-
-    interactions = pd.DataFrame.from_records(
-        [
-            (
-                u1,
-                user_ids[u2_idx],
-                sim,
-                min(supports[user_ids[u1_idx]], supports[user_ids[u2_idx]]),
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    offsets = range(0, A.shape[0], chunk_size)
+    chunks = (A[start : start + chunk_size] for start in offsets)
+
+    pool = _make_pool(executor, n_jobs, _init_topn_worker, (B, top_n, min_similarity))
+    with pool:
+        results = _bounded_map(pool, _topn_chunk, chunks, max_pending=2 * n_jobs)
+        for start, result in tqdm(
+            zip(offsets, results), desc=tqdm_desc, total=len(offsets)
+        ):
+            yield topn_to_interactions(
+                result,
+                user_ids,
+                supports,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+                row_offset=start,
             )
-            for u1_idx, u1 in enumerate(user_ids)
-            for u2_idx, sim in zip(
-                results.indices[results.indptr[u1_idx] : results.indptr[u1_idx + 1]],
-                results.data[results.indptr[u1_idx] : results.indptr[u1_idx + 1]],
+
+
+def _init_tile_worker(A, min_similarity):
+    _worker_state["A"] = A
+    _worker_state["min_similarity"] = min_similarity
+
+
+def _tile_product(bounds):
+    """
+    non-zero similarities of the tile A[i0:i1] x A[j0:j1]^T, upper triangle
+    only if the tile is on the diagonal
+    """
+    i0, i1, j0, j1 = bounds
+    A = _worker_state["A"]
+    min_similarity = _worker_state["min_similarity"]
+
+    tile = (A[i0:i1] @ A[j0:j1].T).tocoo()
+    rows = tile.row.astype(np.int64) + i0
+    cols = tile.col.astype(np.int64) + j0
+    keep = tile.data > (min_similarity if min_similarity is not None else 0)
+    if i0 == j0:
+        keep &= rows < cols
+    return rows[keep], cols[keep], tile.data[keep]
+
+
+def _topn_per_row(rows, cols, sims, top_n):
+    """
+    keep the top_n entries of every row, ties broken by the smaller column
+
+    return:
+        rows, cols, sims : sorted by row, then by decreasing similarity
+    """
+    order = np.lexsort((cols, -sims, rows))
+    rows, cols, sims = rows[order], cols[order], sims[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+    keep = rank < top_n
+    return rows[keep], cols[keep], sims[keep]
+
+
+def _concat_topn(parts, top_n):
+    """
+    concatenate (rows, cols, sims) parts and keep the top_n entries per row
+    """
+    if len(parts) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    return _topn_per_row(*(np.concatenate(a) for a in zip(*parts)), top_n)
+
+
+def iter_symmetric_topn(
+    A,
+    top_n=100,
+    min_similarity=None,
+    chunk_size=10000,
+    n_jobs=1,
+    executor="process",
+    tqdm_desc="calculating interaction",
+):
+    """
+    top-n neighbours of every row of A, computing each unordered pair once
+
+    The similarity matrix is tiled into blocks of chunk_size rows and only
+    the tiles on and above the diagonal are computed. Every similarity of a
+    tile is offered to the top-n lists of both its row and its column. Once
+    all tiles of a block row are done, the lists of its rows are final and
+    the pairs of the block row are yielded.
+
+    As with sp_matmul_topn, the top_n list of a row counts the row itself,
+    so it holds top_n - 1 other rows. A pair (u1, u2) is kept if either
+    user is in the list of the other, and is yielded exactly once. Ties are
+    broken by the smaller index, so the output is deterministic.
+
+    return:
+        generator of (u1, u2, sims) arrays with u1 < u2, one per block row
+    """
+    n = A.shape[0]
+    # self-pairs are never computed, the self match only takes its place
+    top_n = top_n - 1
+    offsets = list(range(0, n, chunk_size))
+
+    # last entry of the final top-n list of every row, to tell whether a
+    # pair was already yielded from the side of its lower row
+    is_full = np.zeros(n, dtype=bool)
+    kth_sim = np.zeros(n, dtype=A.dtype)
+    kth_col = np.zeros(n, dtype=np.int64)
+
+    # candidates offered to the rows of later block rows, by block row,
+    # compacted to top_n per row whenever they grow too large
+    pending = {j0: [] for j0 in offsets}
+    pending_size = dict.fromkeys(offsets, 0)
+
+    def offer(j0, part):
+        pending[j0].append(part)
+        pending_size[j0] += len(part[0])
+        if pending_size[j0] > 2 * top_n * chunk_size:
+            pending[j0] = [_concat_topn(pending[j0], top_n)]
+            pending_size[j0] = len(pending[j0][0][0])
+
+    pool = _make_pool(executor, n_jobs, _init_tile_worker, (A, min_similarity))
+    with pool:
+        for i0 in tqdm(offsets, desc=tqdm_desc):
+            i1 = min(i0 + chunk_size, n)
+            js = [j0 for j0 in offsets if j0 >= i0]
+            tiles = _bounded_map(
+                pool,
+                _tile_product,
+                ((i0, i1, j0, min(j0 + chunk_size, n)) for j0 in js),
+                max_pending=2 * n_jobs,
+            )
+
+            current = pending.pop(i0)
+            for j0, (rows, cols, sims) in zip(js, tiles):
+                # offer each similarity to the lists of its row and column
+                current.append(_topn_per_row(rows, cols, sims, top_n))
+                if j0 == i0:
+                    current.append((cols, rows, sims))
+                else:
+                    offer(j0, _topn_per_row(cols, rows, sims, top_n))
+
+            rows, cols, sims = _concat_topn(current, top_n)
+
+            # finalize the top-n lists of this block row
+            if len(rows) > 0:
+                last = np.append(rows[1:] != rows[:-1], True)
+                row_len = np.bincount(rows - i0, minlength=i1 - i0)
+                is_full[i0:i1] = row_len >= top_n
+                kth_sim[rows[last]] = sims[last]
+                kth_col[rows[last]] = cols[last]
+
+            # a pair seen from its upper row is yielded unless the lower row
+            # already kept it
+            lower = cols < rows
+            in_lower = ~is_full[cols] | (sims > kth_sim[cols])
+            in_lower |= (sims == kth_sim[cols]) & (rows <= kth_col[cols])
+            keep = ~lower | ~in_lower
+
+            u1 = np.where(lower, cols, rows)[keep]
+            u2 = np.where(lower, rows, cols)[keep]
+            order = np.lexsort((u2, u1))
+            yield u1[order], u2[order], sims[keep][order]
+
+
+def iter_interaction_blocks_symmetric(
+    edge_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    top_n=100,
+    min_similarity=None,
+    chunk_size=10000,
+    n_jobs=1,
+    executor="process",
+    min_df=3,
+    cache_path=None,
+):
+    """
+    calculate interactions between nodes in partition 1 with the symmetric
+    engine, block row by block row (see iter_symmetric_topn)
+    """
+    user_ids, A = build_tfidf_matrix(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df, cache_path=cache_path
+    )
+
+    # number of tweets/retweets as support
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    for u1_idx, u2_idx, sims in iter_symmetric_topn(
+        A,
+        top_n=top_n,
+        min_similarity=min_similarity,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        executor=executor,
+    ):
+        yield pairs_to_interactions(
+            u1_idx,
+            u2_idx,
+            sims,
+            user_ids,
+            supports,
+            node1_col,
+            node2_col,
+            sim_col,
+            sup_col,
+        )
+
+
+def write_interaction_blocks(blocks, outfile):
+    """
+    stream blocks of the interaction table into a single parquet file
+
+    return:
+        number of interactions written
+    """
+    writer = None
+    num_rows = 0
+    try:
+        for block in blocks:
+            table = pa.Table.from_pandas(block, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(outfile, table.schema)
+            writer.write_table(table)
+            num_rows += len(block)
+    finally:
+        if writer is not None:
+            writer.close()
+    return num_rows
+
+
+# Mersenne prime used by the universal hash family of the minhash signatures
+_MINHASH_PRIME = (1 << 31) - 1
+
+# default cap on the number of rows of an lsh bucket; a bucket of n rows
+# yields n * (n - 1) / 2 candidate pairs, so a degenerate bucket (e.g. many
+# users sharing one very common feature) would make candidates quadratic
+LSH_MAX_BUCKET_SIZE = 1000
+
+
+def _bucket_pairs(keys):
+    """
+    all pairs (i, j), i < j, of positions that share the same key
+
+    return:
+        u1, u2 : arrays of positions in keys
+    """
+    if len(keys) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    is_start = np.ones(len(keys), dtype=bool)
+    is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(keys))
+
+    # each position is paired with the positions after it in its bucket
+    pos = np.arange(len(keys))
+    partners = np.repeat(ends, ends - starts) - pos - 1
+
+    first = np.repeat(pos, partners)
+    group_start = np.repeat(np.cumsum(partners) - partners, partners)
+    second = first + 1 + np.arange(len(first)) - group_start
+
+    return order[first], order[second]
+
+
+def minhash_candidates(
+    A, num_bands=32, rows_per_band=4, max_bucket_size=LSH_MAX_BUCKET_SIZE, seed=0
+):
+    """
+    candidate pairs of rows of A from minhash/lsh banding
+
+    Each row is treated as the set of its non-zero columns. Rows whose
+    minhash signatures agree on all rows_per_band hashes of at least one
+    band become candidates. Empty rows never become candidates.
+
+    input:
+        A : csr matrix
+        max_bucket_size : buckets with more rows than this are skipped, with
+            a warning; if None all buckets are used
+
+    return:
+        u1, u2 : arrays of row indices with u1 < u2, without duplicates
+    """
+    rng = np.random.default_rng(seed)
+    num_hashes = num_bands * rows_per_band
+    a = rng.integers(1, _MINHASH_PRIME, size=num_hashes, dtype=np.int64)
+    b = rng.integers(0, _MINHASH_PRIME, size=num_hashes, dtype=np.int64)
+
+    nonempty = np.flatnonzero(np.diff(A.indptr) > 0)
+    starts = A.indptr[nonempty]
+    columns = A.indices.astype(np.int64)
+
+    pair_codes = []
+    num_skipped, num_skipped_rows = 0, 0
+    for band in range(num_bands):
+        keys = np.zeros(len(nonempty), dtype=np.uint64)
+        for h in range(band * rows_per_band, (band + 1) * rows_per_band):
+            hashed = (a[h] * columns + b[h]) % _MINHASH_PRIME
+            signature = np.minimum.reduceat(hashed, starts).astype(np.uint64)
+            keys = keys * np.uint64(1000003) ^ signature
+
+        # rows of oversized buckets are dropped before pairing, so that
+        # their pairs are never enumerated
+        rows = np.arange(len(keys))
+        if max_bucket_size is not None:
+            _, bucket, bucket_size = np.unique(
+                keys, return_inverse=True, return_counts=True
             )
-            if u1_idx < u2_idx
-        ],
-        columns=[node1_col, node2_col, sim_col, sup_col],
+            large = bucket_size > max_bucket_size
+            num_skipped += int(large.sum())
+            num_skipped_rows += int(bucket_size[large].sum())
+            rows = rows[~large[bucket]]
+
+        u1, u2 = _bucket_pairs(keys[rows])
+        u1, u2 = nonempty[rows[u1]], nonempty[rows[u2]]
+        pair_codes.append(np.minimum(u1, u2) * A.shape[0] + np.maximum(u1, u2))
+
+    if num_skipped > 0:
+        print(
+            f"WARNING: skipped {num_skipped} lsh buckets of more than "
+            f"{max_bucket_size} rows ({num_skipped_rows} rows over all bands)"
+        )
+
+    pair_codes = np.unique(np.concatenate(pair_codes))
+    return pair_codes // A.shape[0], pair_codes % A.shape[0]
+
+
+def pair_cosine(A, u1, u2, chunk_size=1000000):
+    """
+    dot products between rows u1 and u2 of A, computed chunk by chunk
+    """
+    sims = np.empty(len(u1), dtype=A.dtype)
+    for start in range(0, len(u1), chunk_size):
+        end = start + chunk_size
+        sims[start:end] = np.asarray(
+            A[u1[start:end]].multiply(A[u2[start:end]]).sum(axis=1)
+        ).ravel()
+    return sims
+
+
+def lsh_topn(
+    A,
+    top_n=100,
+    min_similarity=None,
+    num_bands=32,
+    rows_per_band=4,
+    max_bucket_size=LSH_MAX_BUCKET_SIZE,
+    seed=0,
+):
+    """
+    approximate top-n neighbours of every row of the l2-normalized matrix A
+
+    Candidates come from minhash_candidates and only their exact cosine
+    similarities are computed.
+
+    return:
+        results : csr matrix shaped like the output of sp_matmul_topn, whose
+            row i holds at most top_n - 1 neighbours of row i; i is left out
+            but counts towards top_n, as in sp_matmul_topn
+    """
+    u1, u2 = minhash_candidates(
+        A,
+        num_bands=num_bands,
+        rows_per_band=rows_per_band,
+        max_bucket_size=max_bucket_size,
+        seed=seed,
+    )
+    sims = pair_cosine(A, u1, u2)
+
+    kept = sims > (min_similarity if min_similarity is not None else 0)
+    rows = np.concatenate([u1[kept], u2[kept]])
+    cols = np.concatenate([u2[kept], u1[kept]])
+    sims = np.concatenate([sims[kept], sims[kept]])
+
+    # keep the top_n - 1 most similar neighbours of every row
+    order = np.lexsort((-sims, rows))
+    rows, cols, sims = rows[order], cols[order], sims[order]
+    row_start = np.searchsorted(rows, rows, side="left")
+    keep = np.arange(len(rows)) - row_start < top_n - 1
+
+    return csr_matrix(
+        (sims[keep], (rows[keep], cols[keep])), shape=(A.shape[0], A.shape[0])
+    )
+
+
+def lsh_recall(
+    A, results, top_n=100, sample_size=1000, thresholds=(0.0, 0.5, 0.8, 0.9), seed=0
+):
+    """
+    recall of approximate top-n neighbours against the exact top-n product,
+    estimated on a sample of rows
+
+    input:
+        results : output of lsh_topn
+        thresholds : recall is reported for exact neighbours whose
+            similarity is at least each of these values
+
+    return:
+        recall : dict { threshold : recall }, nan if no exact neighbour
+            reaches the threshold
+    """
+    n = A.shape[0]
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+
+    exact = sp_matmul_topn(A[rows], csr_matrix(A.T), top_n=top_n)
+    e_u1 = np.repeat(rows, np.diff(exact.indptr))
+    e_u2 = exact.indices
+    e_sim = exact.data
+    not_self = e_u1 != e_u2
+    e_u1, e_u2, e_sim = e_u1[not_self], e_u2[not_self], e_sim[not_self]
+
+    approx = results[rows]
+    a_u1 = np.repeat(rows, np.diff(approx.indptr))
+    a_u2 = approx.indices
+
+    found = np.isin(e_u1 * n + e_u2, a_u1 * n + a_u2)
+
+    recall = dict()
+    for threshold in thresholds:
+        selected = e_sim >= threshold
+        recall[threshold] = found[selected].mean() if selected.any() else np.nan
+    return recall
+
+
+def calculate_interaction_lsh(
+    edge_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    top_n=100,
+    min_similarity=None,
+    num_bands=32,
+    rows_per_band=4,
+    max_bucket_size=LSH_MAX_BUCKET_SIZE,
+    recall_sample=0,
+    min_df=3,
+    cache_path=None,
+):
+    """
+    calculate interactions between nodes in partition 1 with the
+    approximate minhash/lsh engine
+
+    The output has the same schema as calculate_interaction. If
+    recall_sample > 0, the recall against the exact engine is estimated on
+    that many users and printed.
+    """
+    user_ids, A = build_tfidf_matrix(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df, cache_path=cache_path
+    )
+
+    results = lsh_topn(
+        A,
+        top_n=top_n,
+        min_similarity=min_similarity,
+        num_bands=num_bands,
+        rows_per_band=rows_per_band,
+        max_bucket_size=max_bucket_size,
     )
 
-    return interactions
+    if recall_sample > 0:
+        recall = lsh_recall(A, results, top_n=top_n, sample_size=recall_sample)
+        for threshold, value in recall.items():
+            print(f"LSH recall for similarity >= {threshold}: {value:.4f}")
+
+    # number of tweets/retweets as support
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    return topn_to_interactions(
+        results, user_ids, supports, node1_col, node2_col, sim_col, sup_col
+    )
+
+
+def prefix_split(A, threshold):
+    """
+    split the rows of the l2-normalized matrix A for a similarity join
+
+    Columns are reordered by decreasing document frequency. In each row, the
+    leading (most frequent) entries whose summed upper bound
+    x_f * max_y(y_f) stays below threshold form the unindexed part; the
+    rest (the rarest features) form the prefix. If the similarity of x and y
+    is greater than threshold, x and y share at least one prefix feature
+    of x.
+
+    return:
+        A : A with reordered columns and sorted indices
+        prefix : csr matrix with the prefix entries of A
+        suffix_bound : upper bound of the similarity contributed by the
+            unindexed part of every row
+    """
+    doc_freq = np.bincount(A.indices, minlength=A.shape[1])
+    A = csr_matrix(A[:, np.argsort(-doc_freq, kind="stable")])
+    A.sort_indices()
+    max_weight = A.max(axis=0).toarray().ravel()
+
+    # running bound within each row, frequent features first
+    row_len = np.diff(A.indptr)
+    bound = np.cumsum(A.data * max_weight[A.indices])
+    row_base = np.concatenate([[0], bound])[A.indptr[:-1]]
+    bound -= np.repeat(row_base, row_len)
+
+    in_prefix = bound >= threshold
+
+    # the unindexed part contributes at most the sum of its bounds, and at
+    # most its l2 norm since the other row is unit length
+    suffix_bound = np.zeros(A.shape[0])
+    nonempty = row_len > 0
+    if nonempty.any():
+        starts = A.indptr[:-1][nonempty]
+        suffix_bound[nonempty] = np.minimum(
+            np.add.reduceat(
+                np.where(in_prefix, 0, A.data * max_weight[A.indices]), starts
+            ),
+            np.sqrt(np.add.reduceat(np.where(in_prefix, 0, A.data**2), starts)),
+        )
+
+    prefix = csr_matrix(
+        (np.where(in_prefix, A.data, 0), A.indices.copy(), A.indptr.copy()),
+        shape=A.shape,
+    )
+    prefix.eliminate_zeros()
+
+    return A, prefix, suffix_bound
+
+
+def threshold_join(A, threshold, chunk_size=10000, tqdm_desc="similarity join"):
+    """
+    all pairs of rows of the l2-normalized matrix A whose cosine similarity
+    is greater than threshold, with prefix and length filtering
+
+    Candidates are the pairs that share a prefix feature (see prefix_split).
+    A candidate is dropped without computing its similarity if the score
+    from its prefix plus the bound of the unindexed part, or the length
+    bound max(x) * |y|_1, cannot exceed threshold.
+
+    return:
+        results : csr matrix holding each pair (u1, u2), u1 < u2, once
+    """
+    A, prefix, suffix_bound = prefix_split(A, threshold)
+    B = csr_matrix(A.T)
+
+    row_max = np.zeros(A.shape[0])
+    row_l1 = np.zeros(A.shape[0])
+    nonempty = np.diff(A.indptr) > 0
+    if nonempty.any():
+        row_max[nonempty] = np.maximum.reduceat(A.data, A.indptr[:-1][nonempty])
+        row_l1[nonempty] = np.add.reduceat(A.data, A.indptr[:-1][nonempty])
+
+    pairs_u1, pairs_u2, pairs_sim = [], [], []
+    for start in tqdm(range(0, A.shape[0], chunk_size), desc=tqdm_desc):
+        candidates = (prefix[start : start + chunk_size] @ B).tocoo()
+        u1 = candidates.row.astype(np.int64) + start
+        u2 = candidates.col.astype(np.int64)
+
+        # every qualifying pair shares a prefix feature of both rows, so
+        # each pair only needs to be found from its lower row
+        keep = (
+            (u1 < u2)
+            & (candidates.data + suffix_bound[u1] > threshold)
+            & (row_max[u1] * row_l1[u2] > threshold)
+            & (row_max[u2] * row_l1[u1] > threshold)
+        )
+        u1, u2 = u1[keep], u2[keep]
+
+        sims = pair_cosine(A, u1, u2)
+        above = sims > threshold
+        pairs_u1.append(u1[above])
+        pairs_u2.append(u2[above])
+        pairs_sim.append(sims[above])
+
+    return csr_matrix(
+        (
+            np.concatenate(pairs_sim),
+            (np.concatenate(pairs_u1), np.concatenate(pairs_u2)),
+        ),
+        shape=(A.shape[0], A.shape[0]),
+    )
+
+
+def calculate_interaction_threshold(
+    edge_df,
+    p1_col,
+    p2_col,
+    w_col,
+    node1_col,
+    node2_col,
+    sim_col,
+    sup_col,
+    min_similarity,
+    chunk_size=10000,
+    min_df=3,
+    cache_path=None,
+):
+    """
+    calculate all interactions between nodes in partition 1 whose
+    similarity is greater than min_similarity, without a top-n cap
+
+    The output has the same schema as calculate_interaction.
+    """
+    user_ids, A = build_tfidf_matrix(
+        edge_df, p1_col, p2_col, w_col, min_df=min_df, cache_path=cache_path
+    )
+
+    results = threshold_join(A, min_similarity, chunk_size=chunk_size)
+
+    # number of tweets/retweets as support
+    supports = compute_supports(edge_df, p1_col, w_col, user_ids)
+
+    return topn_to_interactions(
+        results, user_ids, supports, node1_col, node2_col, sim_col, sup_col
+    )
 
 
 def main(args):
@@ -196,6 +1101,104 @@ def main(args):
         required=True,
         help="column name of support",
     )
+    parser.add_argument(
+        "--min-df",
+        action="store",
+        dest="min_df",
+        type=int,
+        default=3,
+        help="features used by fewer users than this are ignored",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        dest="cache_dir",
+        type=str,
+        default=None,
+        help="directory where fitted tf-idf matrices are persisted and reused, keyed by a hash of the edge file and the tf-idf parameters",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        action="store",
+        dest="chunk_size",
+        type=int,
+        default=None,
+        help="number of users per block of the similarity product; if not specified, the whole matrix is multiplied at once (blocks of 10000 users with --engine symmetric or threshold)",
+    )
+    parser.add_argument(
+        "--threads",
+        action="store",
+        dest="threads",
+        type=int,
+        default=1,
+        help="number of workers computing blocks in parallel, only used with --chunk-size",
+    )
+    parser.add_argument(
+        "--executor",
+        action="store",
+        dest="executor",
+        type=str,
+        choices=["process", "thread"],
+        default="process",
+        help="kind of worker pool used with --chunk-size",
+    )
+    parser.add_argument(
+        "--engine",
+        action="store",
+        dest="engine",
+        type=str,
+        choices=["exact", "symmetric", "lsh", "threshold"],
+        default="exact",
+        help="exact top-n product, exact product computing each pair once and keeping it if it is in the top-n of either user, approximate candidates from minhash/lsh banding, or all pairs above --min-similarity",
+    )
+    parser.add_argument(
+        "--top-n",
+        action="store",
+        dest="top_n",
+        type=int,
+        default=100,
+        help="size of the top-n list of each node, the node itself included, so top-n - 1 neighbours are kept; the symmetric engine keeps a pair found in either list; not used with --engine threshold",
+    )
+    parser.add_argument(
+        "--min-similarity",
+        action="store",
+        dest="min_similarity",
+        type=float,
+        default=None,
+        help="only similarities greater than this are kept, required with --engine threshold",
+    )
+    parser.add_argument(
+        "--lsh-bands",
+        action="store",
+        dest="lsh_bands",
+        type=int,
+        default=32,
+        help="number of lsh bands, only used with --engine lsh",
+    )
+    parser.add_argument(
+        "--lsh-rows",
+        action="store",
+        dest="lsh_rows",
+        type=int,
+        default=4,
+        help="number of minhash rows per lsh band, only used with --engine lsh",
+    )
+    parser.add_argument(
+        "--lsh-max-bucket-size",
+        action="store",
+        dest="lsh_max_bucket_size",
+        type=int,
+        default=LSH_MAX_BUCKET_SIZE,
+        help="lsh buckets with more users than this are skipped, with a warning; 0 uses all buckets. Only used with --engine lsh",
+    )
+    parser.add_argument(
+        "--lsh-recall-sample",
+        action="store",
+        dest="lsh_recall_sample",
+        type=int,
+        default=0,
+        help="number of users on which the recall against the exact engine is reported, only used with --engine lsh",
+    )
 
     args = parser.parse_args(args)
     infile = args.infile
@@ -207,14 +1210,135 @@ def main(args):
     node2_col = args.node2
     sim_col = args.sim
     sup_col = args.sup
+    chunk_size = args.chunk_size
+    threads = args.threads
+    executor = args.executor
+    engine = args.engine
+    lsh_bands = args.lsh_bands
+    lsh_rows = args.lsh_rows
+    lsh_max_bucket_size = args.lsh_max_bucket_size or None
+    lsh_recall_sample = args.lsh_recall_sample
+    top_n = args.top_n
+    min_similarity = args.min_similarity
+    min_df = args.min_df
+    cache_dir = args.cache_dir
+
+    if engine == "threshold" and min_similarity is None:
+        parser.error("--engine threshold requires --min-similarity")
 
     # read input
     edge_df = pd.read_parquet(infile)
 
+    cache_path = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = join(
+            cache_dir, tfidf_cache_key(infile, p1_col, p2_col, w_col, min_df)
+        )
+
     if len(edge_df) > 0 and np.any(edge_df.groupby(p1_col).size() > 1):
+        if engine == "lsh":
+            # do work
+            interaction_df = calculate_interaction_lsh(
+                edge_df,
+                p1_col,
+                p2_col,
+                w_col,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+                top_n=top_n,
+                min_similarity=min_similarity,
+                min_df=min_df,
+                cache_path=cache_path,
+                num_bands=lsh_bands,
+                rows_per_band=lsh_rows,
+                max_bucket_size=lsh_max_bucket_size,
+                recall_sample=lsh_recall_sample,
+            )
+            # write output
+            interaction_df.to_parquet(outfile)
+            return
+
+        if engine == "symmetric":
+            # do work and write output block by block
+            blocks = iter_interaction_blocks_symmetric(
+                edge_df,
+                p1_col,
+                p2_col,
+                w_col,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+                top_n=top_n,
+                min_similarity=min_similarity,
+                min_df=min_df,
+                cache_path=cache_path,
+                chunk_size=chunk_size if chunk_size is not None else 10000,
+                n_jobs=threads,
+                executor=executor,
+            )
+            write_interaction_blocks(blocks, outfile)
+            return
+
+        if engine == "threshold":
+            # do work
+            interaction_df = calculate_interaction_threshold(
+                edge_df,
+                p1_col,
+                p2_col,
+                w_col,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+                min_similarity,
+                chunk_size=chunk_size if chunk_size is not None else 10000,
+                min_df=min_df,
+                cache_path=cache_path,
+            )
+            # write output
+            interaction_df.to_parquet(outfile)
+            return
+
+        if chunk_size is not None:
+            # do work and write output block by block
+            blocks = iter_interaction_blocks(
+                edge_df,
+                p1_col,
+                p2_col,
+                w_col,
+                node1_col,
+                node2_col,
+                sim_col,
+                sup_col,
+                top_n=top_n,
+                min_similarity=min_similarity,
+                min_df=min_df,
+                cache_path=cache_path,
+                chunk_size=chunk_size,
+                n_jobs=threads,
+                executor=executor,
+            )
+            write_interaction_blocks(blocks, outfile)
+            return
+
         # do work
         interaction_df = calculate_interaction(
-            edge_df, p1_col, p2_col, w_col, node1_col, node2_col, sim_col, sup_col
+            edge_df,
+            p1_col,
+            p2_col,
+            w_col,
+            node1_col,
+            node2_col,
+            sim_col,
+            sup_col,
+            top_n=top_n,
+            min_similarity=min_similarity,
+            min_df=min_df,
+            cache_path=cache_path,
         )
         # write output
         interaction_df.to_parquet(outfile)
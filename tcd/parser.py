@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import argparse
+import gzip
+import os
 import re
 import sys
-from collections import Counter, defaultdict
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from os.path import join
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import ujson as json
 from tqdm import tqdm
 
@@ -13,25 +19,138 @@ SOURCE_REGEX = re.compile(r'<a href=(?:\\*)\"(.+)(?:\\*)\" rel=(?:\\*)\"(.*)(?:\
 
 
 
-def counters2edges(counter_dict, p1_col, p2_col, w_col):
-    edge = pd.DataFrame.from_records([
-        (uid, feature, count)
-        for uid, feature_counter in counter_dict.items()
-        for feature, count in feature_counter.items()
-    ], columns=[p1_col, p2_col, w_col])
-    return edge
+class EdgeAccumulator:
+    """
+    counts of (user, feature) pairs, kept as integer codes
 
+    Users and features are interned into dicts { value : code }, and the
+    codes of every use of a feature are appended to growable typed arrays.
+    Pairs are reduced to unique pairs and their counts by a sort once the
+    pending pairs outnumber both buffer_size and the unique pairs so far,
+    and when the edges are written.
+    """
 
-def prepare_content(in_fp, tqdm_desc="parse raw content", tqdm_total=None):
+    def __init__(self, buffer_size=1 << 22):
+        self.users = dict()
+        self.features = dict()
+        self.buffer_size = buffer_size
+        self._user_buffer = array('q')
+        self._feature_buffer = array('q')
+        # pairs, as user code << 32 | feature code, and their counts
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._pending_keys = []
+        self._pending_counts = []
+        self._num_pending = 0
+
+    def __len__(self):
+        self.compact()
+        return len(self._keys)
+
+    def add(self, user, features):
+        """
+        count one use of each of the features by user
+        """
+        if not features:
+            return
+        user_code = self.users.setdefault(user, len(self.users))
+        for feature in features:
+            self._user_buffer.append(user_code)
+            self._feature_buffer.append(self.features.setdefault(feature, len(self.features)))
+        if len(self._user_buffer) >= self.buffer_size:
+            self._flush_buffer()
+            self._reduce_if_full()
+
+    def _flush_buffer(self):
+        if len(self._user_buffer) == 0:
+            return
+        keys = np.frombuffer(self._user_buffer, dtype=np.int64) << 32 | np.frombuffer(self._feature_buffer, dtype=np.int64)
+        self._user_buffer = array('q')
+        self._feature_buffer = array('q')
+        self._append(keys, np.ones(len(keys), dtype=np.int64))
+
+    def _append(self, keys, counts):
+        self._pending_keys.append(keys)
+        self._pending_counts.append(counts)
+        self._num_pending += len(keys)
+
+    def _reduce_if_full(self):
+        # reducing only once the pending pairs outnumber the unique ones keeps
+        # the total sorting work at O(n log n)
+        if self._num_pending >= max(self.buffer_size, len(self._keys)):
+            self.compact()
+
+    def compact(self):
+        """
+        reduce all pairs counted so far to unique pairs
+        """
+        self._flush_buffer()
+        if self._num_pending == 0:
+            return
+        keys = np.concatenate([self._keys, *self._pending_keys])
+        counts = np.concatenate([self._counts, *self._pending_counts])
+        self._pending_keys = []
+        self._pending_counts = []
+        self._num_pending = 0
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse, weights=counts, minlength=len(self._keys)).astype(np.int64)
+
+    def merge(self, other):
+        """
+        add the counts of another accumulator
+        """
+        other.compact()
+        user_map = np.array([self.users.setdefault(u, len(self.users)) for u in other.users], dtype=np.int64)
+        feature_map = np.array([self.features.setdefault(f, len(self.features)) for f in other.features], dtype=np.int64)
+        if len(other._keys) == 0:
+            return
+        keys = user_map[other._keys >> 32] << 32 | feature_map[other._keys & 0xffffffff]
+        self._append(keys, other._counts)
+        self._reduce_if_full()
+
+    def pairs(self):
+        """
+        return:
+            users, features : lists of the interned values, in code order
+            user_codes, feature_codes, counts : arrays of the unique pairs
+        """
+        self.compact()
+        return list(self.users), list(self.features), self._keys >> 32, self._keys & 0xffffffff, self._counts
+
+    def to_table(self, p1_col, p2_col, w_col):
+        """
+        edge table with dictionary-encoded user and feature columns, sorted
+        by user then feature; the dictionaries are sorted too
+        """
+        users, features, user_codes, feature_codes, counts = self.pairs()
+        columns = []
+        for values, codes in ((users, user_codes), (features, feature_codes)):
+            order = np.argsort(np.array(values, dtype=object), kind='stable')
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            columns.append((rank[codes], pa.array([values[k] for k in order])))
+
+        (user_codes, users), (feature_codes, features) = columns
+        order = np.lexsort([feature_codes, user_codes])
+        return pa.table({
+            p1_col: pa.DictionaryArray.from_arrays(user_codes[order], users),
+            p2_col: pa.DictionaryArray.from_arrays(feature_codes[order], features),
+            w_col: counts[order],
+        })
+
+
+FEATURES = [
+    'hashtags',
+    'selected_hashtags'
+]
+
+
+def prepare_content(in_fp, tqdm_desc="parse raw content", tqdm_total=None, progress=True):
     user_features = {
-        feature : defaultdict(Counter) for feature in
-            [
-                'hashtags',
-                'selected_hashtags'
-            ]
+        feature : EdgeAccumulator() for feature in FEATURES
     }
 
-    for line in tqdm(in_fp, desc=tqdm_desc, total=tqdm_total):
+    for line in tqdm(in_fp, desc=tqdm_desc, total=tqdm_total, disable=not progress):
         try:
             twt = json.loads(line)
         except Exception as e:
@@ -40,13 +159,102 @@ def prepare_content(in_fp, tqdm_desc="parse raw content", tqdm_total=None):
 
         user_id = twt['user_id']
 
-        # count up the number of times each hashtag is used
-        for ht in twt['hashtags']:
-            user_features['hashtags'][user_id][ht] += 1
+        # count up the number of times each hashtag and selected hashtag is used
+        for feature, accumulator in user_features.items():
+            accumulator.add(user_id, twt[feature])
+
+    return user_features
+
+
+def open_raw(infile):
+    """
+    open a raw tweet file, gzipped or not
 
-        # count up the number of times each selected hashtag is used
-        for sht in twt['selected_hashtags']:
-            user_features['selected_hashtags'][user_id][sht] += 1
+    return: (binary stream of the decompressed content, underlying file
+        whose position is the number of input bytes read)
+    """
+    raw = open(infile, 'rb')
+    is_gzip = raw.read(2) == b'\x1f\x8b'
+    raw.seek(0)
+    return (gzip.GzipFile(fileobj=raw) if is_gzip else raw), raw
+
+
+def iter_chunks(stream, chunk_bytes):
+    """
+    split a binary stream into chunks of about chunk_bytes bytes that end on
+    a line boundary
+    """
+    rest = b''
+    while True:
+        block = stream.read(chunk_bytes)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind(b'\n') + 1
+        rest = block[end:]
+        if end > 0:
+            yield block[:end]
+    if rest:
+        yield rest
+
+
+def _parse_chunk(chunk):
+    return prepare_content(chunk.splitlines(), progress=False)
+
+
+def _map_chunks(func, chunks, n_jobs):
+    """
+    apply func to the chunks of (chunk, position) pairs, in a pool of n_jobs
+    processes with at most 2 * n_jobs chunks in flight
+
+    return: iterator of (result, position), in order
+    """
+    if n_jobs <= 1:
+        for chunk, position in chunks:
+            yield func(chunk), position
+        return
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        pending = deque()
+        for chunk, position in chunks:
+            pending.append((pool.submit(func, chunk), position))
+            if len(pending) >= 2 * n_jobs:
+                future, position = pending.popleft()
+                yield future.result(), position
+        while pending:
+            future, position = pending.popleft()
+            yield future.result(), position
+
+
+def merge_features(user_features, partial):
+    for feature, accumulator in partial.items():
+        user_features[feature].merge(accumulator)
+
+
+def parse_raw(infile, n_jobs=1, chunk_bytes=64 << 20, tqdm_desc="parse raw content"):
+    """
+    stream a raw tweet file (json lines, optionally gzipped) and count the
+    features of each user
+
+    The decompressed stream is cut into chunks of lines that are parsed in
+    a pool of n_jobs processes; their counts are merged as they come back.
+    Progress is reported in bytes of the input file, so the number of lines
+    is not needed.
+    """
+    user_features = {
+        feature : EdgeAccumulator() for feature in FEATURES
+    }
+
+    stream, raw = open_raw(infile)
+    with raw, stream, tqdm(total=os.path.getsize(infile), desc=tqdm_desc, unit='B', unit_scale=True) as progress:
+        chunks = (
+            (chunk, raw.tell()) for chunk in iter_chunks(stream, chunk_bytes)
+        )
+        done = 0
+        for partial, position in _map_chunks(_parse_chunk, chunks, n_jobs):
+            merge_features(user_features, partial)
+            progress.update(position - done)
+            done = position
 
     return user_features
 
@@ -58,13 +266,10 @@ def main(args):
 
     parser.add_argument('-i', '--infile',
         action="store", dest="infile", type=str, required=True,
-        help="path to input parquet file of edge table")
+        help="path to input raw tweet file (json lines, optionally gzipped)")
     parser.add_argument('-o', '--outdir',
         action="store", dest="outdir", type=str, required=True,
         help="path to output directory for output randomized edge tables")
-    parser.add_argument('-n', '--numline',
-        action="store", dest="numline", type=int, required=True,
-        help="number of lines in the input file")
     parser.add_argument('--p1col',
         action="store", dest="p1col", type=str, required=True,
         help="column name of nodes in partite 1")
@@ -74,32 +279,32 @@ def main(args):
     parser.add_argument('--wcol',
         action="store", dest="wcol", type=str, required=True,
         help="column name of edge weights")
+    parser.add_argument('--threads',
+        action="store", dest="threads", type=int, default=1,
+        help="number of processes parsing the input")
+    parser.add_argument('--chunk-bytes',
+        action="store", dest="chunk_bytes", type=int, default=64 << 20,
+        help="number of decompressed bytes parsed at a time by a process")
 
     args = parser.parse_args(args)
     infile = args.infile
     outdir = args.outdir
-    numline = args.numline
+    threads = args.threads
+    chunk_bytes = args.chunk_bytes
     p1_col = args.p1col
     p2_col = args.p2col
     w_col = args.wcol
 
-    # read input
-    with open(infile, 'rb') as in_fp:
-        # do work
-        user_features = prepare_content(in_fp, tqdm_total=numline)
+    # read input and do work
+    user_features = parse_raw(infile, n_jobs=threads, chunk_bytes=chunk_bytes)
 
     # write output
-    for feature, counter_dict in user_features.items():
+    for feature, accumulator in user_features.items():
         fname = "{}.edge.parquet".format(feature)
         output_name = join(outdir, fname)
 
-        if len(counter_dict) == 0:
-            with open(output_name, 'w') as f:
-                pass
-
-        edge_df = counters2edges(counter_dict, p1_col, p2_col, w_col)
-
-        edge_df.to_parquet(output_name)
+        # an empty accumulator gives a valid parquet file of no rows
+        pq.write_table(accumulator.to_table(p1_col, p2_col, w_col), output_name)
 
 
 
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# the results store is a hive-partitioned parquet dataset, one partition per
+# group file of the features/{dataset}/{feature}/{percent}/ layout
+PARTITION_KEYS = ["dataset", "feature", "interaction_percent"]
+PARTITIONING = ds.partitioning(
+    pa.schema([(key, pa.string()) for key in PARTITION_KEYS]), flavor="hive"
+)
+
+METRICS = ["precision", "recall", "sensitivity", "specificity", "f1_score", "roc_auc"]
+RESULT_SCHEMA = pa.schema(
+    [("group_id", pa.int64()), ("num_accounts", pa.int64())]
+    + [(metric, pa.float64()) for metric in METRICS]
+)
+
+
+def path_keys(path):
+    """
+    partition keys of a file in the features/{dataset}/{feature}/{percent}/
+    layout, e.g. a group.json
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    return dict(zip(PARTITION_KEYS, parts[-4:-1]))
+
+
+def stats_table(summary_stats):
+    """
+    one row per group of the output of group_stats.compute_statistics
+    """
+    df = pd.DataFrame(
+        {
+            "group_id": np.arange(summary_stats["num_groups"]),
+            "num_accounts": summary_stats["num_accounts_per_group"],
+            **{metric: summary_stats[metric] for metric in METRICS},
+        }
+    )
+    return pa.Table.from_pandas(df, schema=RESULT_SCHEMA, preserve_index=False)
+
+
+def write_results(store, summary_stats, dataset, feature, interaction_percent):
+    """
+    write the statistics of one group file to its partition of the store,
+    replacing what a previous run wrote there
+
+    return: path of the written file
+    """
+    partition = os.path.join(
+        store,
+        f"dataset={dataset}",
+        f"feature={feature}",
+        f"interaction_percent={interaction_percent}",
+    )
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, "part-0.parquet")
+    pq.write_table(stats_table(summary_stats), path)
+    return path
+
+
+def partition_filter(**keys):
+    """
+    pyarrow.dataset expression selecting the partitions whose keys are in the
+    given lists, e.g. partition_filter(dataset=["hk"], feature=["hashtags"]);
+    keys that are None are not filtered on
+
+    return: expression, or None when nothing is filtered
+    """
+    expression = None
+    for key, values in keys.items():
+        if key not in PARTITION_KEYS:
+            raise ValueError(f"unknown partition key {key}")
+        if values is None:
+            continue
+        condition = ds.field(key).isin([str(value) for value in values])
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_results(store, columns=None, filter=None):
+    """
+    query the results store
+
+    input:
+        columns : list of columns to read, partition keys included
+        filter : pyarrow.dataset expression, e.g. ds.field("feature") == "hashtags"
+    return: DataFrame
+    """
+    dataset = ds.dataset(store, format="parquet", partitioning=PARTITIONING)
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
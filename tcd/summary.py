@@ -4,6 +4,8 @@ import csv
 
 import pandas as pd
 
+from tcd.results import METRICS, partition_filter, read_results
+
 
 def summarize_stats(input_files, output_file):
     stats_ls = []
@@ -33,8 +35,34 @@ def summarize_stats(input_files, output_file):
 
             stats_ls.append(group_dict)
 
-    df = pd.DataFrame(stats_ls)
+    write_summary(pd.DataFrame(stats_ls), output_file)
+
+
+def summarize_results(
+    store, output_file, feature=None, datasets=None, interaction_percents=None
+):
+    """
+    same table as summarize_stats, queried from the results store
+
+    input:
+        feature : only summarize this feature (dimension)
+        datasets : only summarize these datasets
+        interaction_percents : only summarize these interaction percents, as
+            in the partition paths
+    """
+    df = read_results(
+        store,
+        columns=["group_id", "dataset", "feature", "interaction_percent", *METRICS],
+        filter=partition_filter(
+            dataset=datasets,
+            feature=[feature] if feature is not None else None,
+            interaction_percent=interaction_percents,
+        ),
+    )
+    write_summary(df, output_file)
 
+
+def write_summary(df, output_file):
     try:
         df = df.sort_values(
             by=["dataset", "feature", "interaction_percent", "group_id"]
@@ -52,9 +80,38 @@ def summarize_stats(input_files, output_file):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calculate group statistics")
-    parser.add_argument("-i", "--group-stats", nargs="+", help="List of input files")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("-i", "--group-stats", nargs="+", help="List of input files")
+    inputs.add_argument(
+        "--results", help="Path to the results store written by tcd.group_stats"
+    )
     parser.add_argument("-o", "--output", help="Output file")
+    parser.add_argument(
+        "--feature", default=None, help="With --results, only summarize this feature"
+    )
+
+    parser.add_argument(
+        "--datasets",
+        nargs="+",
+        default=None,
+        help="With --results, only summarize these datasets",
+    )
+    parser.add_argument(
+        "--interaction-percents",
+        nargs="+",
+        default=None,
+        help="With --results, only summarize these interaction percents",
+    )
 
     args = parser.parse_args()
 
-    summarize_stats(args.group_stats, args.output)
+    if args.results is not None:
+        summarize_results(
+            args.results,
+            args.output,
+            feature=args.feature,
+            datasets=args.datasets,
+            interaction_percents=args.interaction_percents,
+        )
+    else:
+        summarize_stats(args.group_stats, args.output)
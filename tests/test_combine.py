@@ -0,0 +1,74 @@
+import json
+
+import pandas as pd
+import pyarrow as pa
+
+from tcd.combine import group_context, write_contexts
+from tcd.index import TweetIndex, build_index
+
+
+def tweet_index(path):
+    tweets = pa.table(
+        {
+            "user_id": ["a", "b", "c", "a", "b", "c", "a"],
+            "created_at": [
+                "2024-06-01T10:05:00Z",
+                "2024-06-01T10:20:00Z",
+                "2024-06-01T10:40:00Z",
+                "2024-06-02T08:00:00Z",
+                "2024-06-03T09:00:00Z",
+                "not a date",
+                "2024-06-01T10:50:00Z",
+            ],
+            "text": ["t1", "t2", "t3", "t4", "t5", "t6", "t7"],
+        }
+    )
+    build_index(tweets, str(path))
+    return TweetIndex(str(path))
+
+
+def test_group_context(tmp_path):
+    index = tweet_index(tmp_path / "index")
+    edge_df = pd.DataFrame(
+        {
+            "uid": ["a", "b", "c", "a", "d"],
+            "feature": ["#x", "#x", "#x", "#y", "#y"],
+            "cnt": [1, 2, 1, 5, 1],
+        }
+    )
+
+    # members are read one batch of two at a time
+    context = group_context(
+        ["a", "b", "c"], index, edge_df=edge_df, batch_size=2, window="1h"
+    )
+
+    assert context["num_tweets"] == 7
+    assert context["num_unparsed_tweets"] == 1
+    assert context["first_tweet"] == "2024-06-01T10:05:00+00:00"
+    assert context["last_tweet"] == "2024-06-03T09:00:00+00:00"
+    assert context["co_activity"] == [
+        {"window": "2024-06-01T10:00:00+00:00", "num_members": 3, "num_tweets": 4}
+    ]
+    assert [t["text"] for t in context["tweets"]] == ["t1", "t2", "t3", "t7"]
+    # #y is used by a single member of the group
+    assert context["shared_features"] == [
+        {"feature": "#x", "num_members": 3, "count": 4.0}
+    ]
+
+
+def test_write_contexts_reports_unparsed_tweets(tmp_path, capsys):
+    index = tweet_index(tmp_path / "index")
+    group = tmp_path / "group.json"
+    group.write_text(json.dumps([["a", "b"], ["c"]]))
+    empty = tmp_path / "empty.json"
+    empty.touch()
+    contexts = [tmp_path / "context.json", tmp_path / "empty_context.json"]
+
+    write_contexts([str(group), str(empty)], [str(c) for c in contexts], index)
+
+    result = json.loads(contexts[0].read_text())
+    assert [c["group_id"] for c in result] == [0, 1]
+    assert [c["num_unparsed_tweets"] for c in result] == [0, 1]
+    assert result[1]["co_activity"] == []
+    assert contexts[1].stat().st_size == 0
+    assert "1 member tweets" in capsys.readouterr().out
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcd.create_pacheco_edges_v2 import (
+    feature_ids,
+    feature_names,
+    hashtag_sets,
+    parse_hashtags,
+    process_tweets,
+    process_tweets_streaming,
+)
+
+
+def test_parse_hashtags_skips_empty_strings():
+    hashtags = pd.Series(["['#a', '', '#b']", "['']", "[' ']", "[]", None])
+    parsed = parse_hashtags(hashtags)
+    assert parsed.tolist() == ["#a", "#b"]
+    assert parsed.index.tolist() == [0, 0]
+
+
+def test_parse_hashtags_unescapes_quotes():
+    hashtags = pd.Series(["['#it\\'s', \"#a\\\"b\"]", "['#back\\\\']"])
+    parsed = parse_hashtags(hashtags)
+    assert parsed.tolist() == ["#it's", '#a"b', "#back\\"]
+    assert parsed.index.tolist() == [0, 0, 1]
+
+
+def test_feature_names_with_empty_entries():
+    df = pd.DataFrame(
+        {
+            "author_id": ["1", "1", "2"],
+            "date": ["2020-01-01", "2020-01-01", "2020-01-01"],
+            "hashtags": ["['#b', '']", "['#a']", "['', '#a', '#b']"],
+        }
+    )
+    pairs, pair_codes, hashtags = hashtag_sets(df, 1, 1)
+    pairs["feature"] = feature_ids(pairs["date"].to_numpy(), pair_codes, hashtags)
+
+    # both accounts used the set {#a, #b} that day
+    assert pairs["feature"].nunique() == 1
+    names = feature_names(pairs, pair_codes, hashtags)
+    assert names["name"].tolist() == ["2020-01-01_#a-#b"]
+
+
+def test_feature_ids_do_not_depend_on_hashtag_order():
+    pair_dates = np.array(["2020-01-01", "2020-01-01", "2020-01-02", "2020-01-01"])
+    pair_codes = np.array([0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3])
+    hashtags = np.array(
+        ["#a", "#b", "#c", "#c", "#a", "#b", "#b", "#c", "#a", "#a", "#b"]
+    )
+    ids = feature_ids(pair_dates, pair_codes, hashtags)
+
+    assert ids.dtype == np.int64
+    # same set on the same date, listed in another order
+    assert ids[0] == ids[1]
+    # same set on another date
+    assert ids[0] != ids[2]
+    # a subset of the set
+    assert ids[0] != ids[3]
+
+    # the ids do not depend on the order of the pairs either
+    order = np.array([3, 0, 1, 2, 4, 5, 10, 9, 7, 8, 6])
+    assert np.array_equal(
+        feature_ids(pair_dates, pair_codes[order], hashtags[order]), ids
+    )
+
+
+def random_tweets(num_tweets=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    hashtags = [f"#t{i}" for i in range(8)]
+    lists = [
+        str(list(rng.choice(hashtags, size=rng.integers(0, 4), replace=False)))
+        for _ in range(num_tweets)
+    ]
+    created_at = [
+        f"2024-06-{rng.integers(1, 6):02d}T{rng.integers(0, 24):02d}:00:00Z"
+        for _ in range(num_tweets)
+    ]
+    created_at[0] = "not a date"
+    return pd.DataFrame(
+        {
+            "author_id": [f"user{i:03d}" for i in rng.integers(0, 150, num_tweets)],
+            "created_at": created_at,
+            "is_needle": rng.integers(0, 2, num_tweets),
+            "hashtags": lists,
+        }
+    )
+
+
+@pytest.mark.parametrize("min_num_tweets,min_num_hashtags", [(1, 1), (2, 2)])
+def test_streaming_matches_in_memory(tmp_path, min_num_tweets, min_num_hashtags):
+    tweets = tmp_path / "tweets.csv"
+    random_tweets().to_csv(tweets, index=False)
+    cache_dir = str(tmp_path / "cache")
+
+    process_tweets(
+        str(tweets),
+        str(tmp_path / "edge.parquet"),
+        min_num_tweets,
+        min_num_hashtags,
+        cache_dir=cache_dir,
+    )
+    # small batches, so that a day is spread over several of them
+    process_tweets_streaming(
+        str(tweets),
+        str(tmp_path / "streaming.parquet"),
+        min_num_tweets,
+        min_num_hashtags,
+        n_jobs=2,
+        batch_size=300,
+        cache_dir=cache_dir,
+    )
+
+    edges = pd.read_parquet(tmp_path / "edge.parquet").reset_index(drop=True)
+    assert len(edges) > 0
+    assert edges.equals(pd.read_parquet(tmp_path / "streaming.parquet"))
+    names = pd.read_parquet(tmp_path / "edge.names.parquet")
+    assert names.equals(pd.read_parquet(tmp_path / "streaming.names.parquet"))
+    assert not (tmp_path / "edge.csv").exists()
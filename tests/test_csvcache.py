@@ -0,0 +1,98 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from tcd import csvcache
+from tcd.csvcache import cached_parquet, convert_csv, read_csv_cached
+
+NUM_ROWS = 20000
+
+
+def sparse_csv(path):
+    # every typed column is empty, or looks like another type, in the first
+    # blocks of the file
+    df = pd.DataFrame(
+        {
+            "handle": [f"{i:05d}" for i in range(NUM_ROWS)],
+            "bot": [""] * (NUM_ROWS - 2) + ["1", "0"],
+            "score": ["1"] * (NUM_ROWS - 1) + ["2.5"],
+            "egg": [""] * (NUM_ROWS - 3) + ["TRUE", "", "false"],
+            "client": [""] * (NUM_ROWS - 1) + ["web"],
+            "created_at": ["2024-06-01T00:00:00Z"] * NUM_ROWS,
+        }
+    )
+    df.to_csv(path, index=False)
+
+
+def test_convert_csv_infers_types_over_whole_columns(tmp_path):
+    path = tmp_path / "authors.csv"
+    sparse_csv(path)
+    outfile = tmp_path / "authors.parquet"
+
+    convert_csv(str(path), str(outfile), block_size=1 << 14, batch_size=5000)
+
+    schema = pq.read_schema(outfile)
+    assert schema.names == ["author_id", "bot", "score", "egg", "client", "created_at"]
+    assert [field.type for field in schema] == [
+        pa.string(),
+        pa.int64(),
+        pa.float64(),
+        pa.bool_(),
+        pa.string(),
+        pa.string(),
+    ]
+
+    table = pq.read_table(outfile)
+    assert table["bot"].null_count == NUM_ROWS - 2
+    assert table["bot"].to_pylist()[-2:] == [1, 0]
+    assert table["egg"].to_pylist()[-3:] == [True, None, False]
+    assert table["author_id"][0].as_py() == "00000"
+
+
+def test_read_csv_cached_matches_pandas(tmp_path):
+    path = tmp_path / "authors.csv"
+    sparse_csv(path)
+
+    df = read_csv_cached(str(path), cache_dir=str(tmp_path / "cache"))
+    expected = pd.read_csv(path, dtype={"handle": str})
+    expected = expected.rename(columns={"handle": "author_id"})
+    for column in ["bot", "score"]:
+        assert df[column].dtype == expected[column].dtype
+        assert df[column].equals(expected[column])
+    assert df["egg"].tolist()[-3:] == [True, None, False]
+
+
+def test_cached_parquet_hashes_unchanged_files_once(tmp_path, monkeypatch):
+    path = tmp_path / "tweets.csv"
+    path.write_text("author_id,is_needle\na,1\nb,0\n")
+    cache_dir = str(tmp_path / "cache")
+    cached = cached_parquet(str(path), cache_dir)
+
+    def fail(path):
+        raise AssertionError("an unchanged file was hashed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(csvcache, "content_hash", fail)
+        assert cached_parquet(str(path), cache_dir) == cached
+
+    # a new content gets a new cache file, and the old one is removed
+    path.write_text("author_id,is_needle\na,1\nb,0\nc,1\n")
+    updated = cached_parquet(str(path), cache_dir)
+    assert updated != cached
+    assert not os.path.exists(cached)
+    assert pq.read_table(updated)["is_needle"].to_pylist() == [1, 0, 1]
+
+
+def test_csv_files_of_the_same_name_share_a_cache_dir(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    paths = [tmp_path / "hk" / "authors.csv", tmp_path / "xj" / "authors.csv"]
+    for i, path in enumerate(paths):
+        path.parent.mkdir()
+        path.write_text(f"author_id,is_needle\na{i},1\n")
+
+    cached = [cached_parquet(str(path), cache_dir) for path in paths]
+    assert all(os.path.exists(c) for c in cached)
+    assert read_csv_cached(str(paths[0]), cache_dir=cache_dir)["author_id"][0] == "a0"
+    assert cached_parquet(str(paths[0]), cache_dir) == cached[0]
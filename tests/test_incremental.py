@@ -0,0 +1,276 @@
+import json
+from os.path import join
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tcd import incremental
+from tcd.measure import (
+    compute_supports,
+    count_matrix,
+    iter_symmetric_topn,
+    pairs_to_interactions,
+    save_tfidf_artifact,
+)
+
+COLUMNS = dict(
+    p1_col="uid",
+    p2_col="feature",
+    w_col="cnt",
+    node1_col="user1",
+    node2_col="user2",
+    sim_col="similarity",
+    sup_col="support",
+)
+TOP_N = 5
+
+
+def random_edges(users, features, edges_per_user=6, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for user in users:
+        for feature in rng.choice(features, size=edges_per_user, replace=False):
+            rows.append((user, feature, int(rng.integers(1, 5))))
+    return pd.DataFrame(rows, columns=["uid", "feature", "cnt"])
+
+
+def add_edges(edge_df, delta_df):
+    # as tcd.incremental.main sums the delta into the previous edges
+    edge_df = pd.concat([edge_df, delta_df], ignore_index=True)
+    return edge_df.groupby(["uid", "feature"], as_index=False)["cnt"].sum()
+
+
+def create_state(state, edge_df):
+    model = incremental.rebuild(
+        state,
+        edge_df,
+        top_n=TOP_N,
+        num_partitions=8,
+        chunk_size=64,
+        executor="thread",
+        **COLUMNS,
+    )
+    save_tfidf_artifact(join(state, "tfidf"), *model)
+    return model
+
+
+def read_interactions(path):
+    df = incremental.read_partitions(path)
+    return df.sort_values(["user1", "user2"]).reset_index(drop=True)
+
+
+def assert_same_interactions(actual, expected):
+    assert actual[["user1", "user2"]].equals(expected[["user1", "user2"]])
+    np.testing.assert_allclose(actual["similarity"], expected["similarity"])
+    np.testing.assert_array_equal(actual["support"], expected["support"])
+
+
+def symmetric_interactions(edge_df, A):
+    """
+    interactions of a full run of the symmetric engine on the matrix A
+    """
+    user_ids, _, _ = count_matrix(edge_df, "uid", "feature", "cnt")
+    supports = compute_supports(edge_df, "uid", "cnt", user_ids)
+    df = pd.concat(
+        [
+            pairs_to_interactions(
+                u1,
+                u2,
+                sims,
+                user_ids,
+                supports,
+                "user1",
+                "user2",
+                "similarity",
+                "support",
+            )
+            for u1, u2, sims in iter_symmetric_topn(
+                A, top_n=TOP_N, chunk_size=64, executor="thread"
+            )
+        ],
+        ignore_index=True,
+    )
+    return df.sort_values(["user1", "user2"]).reset_index(drop=True)
+
+
+@pytest.fixture
+def base_edges():
+    users = [f"u{i:03d}" for i in range(200)]
+    features = [f"f{i:02d}" for i in range(40)]
+    return random_edges(users, features)
+
+
+def test_update_matches_symmetric_engine_with_frozen_idf(tmp_path, base_edges):
+    state = str(tmp_path / "state")
+    create_state(state, base_edges)
+
+    # new authors, using old features and features new to the vocabulary
+    new_users = [f"v{i:03d}" for i in range(30)]
+    features = [f"f{i:02d}" for i in range(40)] + [f"g{i}" for i in range(5)]
+    delta_df = random_edges(new_users, features, seed=1)
+    edge_df = add_edges(base_edges, delta_df)
+
+    model = incremental.update(
+        state,
+        edge_df,
+        delta_df,
+        top_n=TOP_N,
+        num_partitions=8,
+        idf_tolerance=1.0,
+        chunk_size=64,
+        **COLUMNS,
+    )
+    assert model is not None
+    user_ids, features, idf, A = model
+    assert features.isin([f"g{i}" for i in range(5)]).any()
+
+    assert_same_interactions(
+        read_interactions(join(state, "interactions")),
+        symmetric_interactions(edge_df, A),
+    )
+
+
+def test_update_matches_rebuild_when_idf_is_unchanged(tmp_path, base_edges):
+    state = str(tmp_path / "state")
+    create_state(state, base_edges)
+
+    # old authors only, with more of the features they already use and
+    # features new to the vocabulary: no old idf changes
+    rng = np.random.default_rng(2)
+    old = base_edges.sample(60, random_state=3)
+    new_features = [f"g{i}" for i in range(4)]
+    users = old["uid"].unique()[:20]
+    delta_df = pd.concat(
+        [
+            old.assign(cnt=rng.integers(1, 4, size=len(old))),
+            pd.DataFrame(
+                {
+                    "uid": np.repeat(users, 2),
+                    "feature": rng.choice(new_features, size=2 * len(users)),
+                    "cnt": 1,
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    edge_df = add_edges(base_edges, delta_df)
+
+    model = incremental.update(
+        state,
+        edge_df,
+        delta_df,
+        top_n=TOP_N,
+        num_partitions=8,
+        idf_tolerance=0.0,
+        chunk_size=64,
+        **COLUMNS,
+    )
+    assert model is not None
+
+    full = str(tmp_path / "full")
+    incremental.rebuild(
+        full,
+        edge_df,
+        top_n=TOP_N,
+        num_partitions=8,
+        chunk_size=64,
+        executor="thread",
+        **COLUMNS,
+    )
+    assert_same_interactions(
+        read_interactions(join(state, "interactions")),
+        read_interactions(join(full, "interactions")),
+    )
+
+
+def cli_args(state, idf_tolerance):
+    return [
+        "-s",
+        state,
+        "--p1col",
+        "uid",
+        "--p2col",
+        "feature",
+        "--wcol",
+        "cnt",
+        "--node1",
+        "user1",
+        "--node2",
+        "user2",
+        "--sim",
+        "similarity",
+        "--sup",
+        "support",
+        "--top-n",
+        str(TOP_N),
+        "--num-partitions",
+        "8",
+        "--chunk-size",
+        "64",
+        "--executor",
+        "thread",
+        "--idf-tolerance",
+        str(idf_tolerance),
+    ]
+
+
+def test_drift_beyond_tolerance_forces_rebuild(tmp_path, base_edges):
+    state = str(tmp_path / "state")
+    users = [f"u{i:03d}" for i in range(200)]
+    half = base_edges[base_edges["uid"].isin(users[:100])]
+    delta_df = base_edges[~base_edges["uid"].isin(users[:100])]
+    half.to_parquet(tmp_path / "half.parquet", index=False)
+    delta_df.to_parquet(tmp_path / "delta.parquet", index=False)
+
+    args = cli_args(state, idf_tolerance=0.001)
+    incremental.main(args + ["-d", str(tmp_path / "half.parquet")])
+
+    # doubling the authors moves every idf by more than the tolerance
+    edge_df = add_edges(half, delta_df)
+    assert (
+        incremental.update(
+            state,
+            edge_df,
+            delta_df,
+            top_n=TOP_N,
+            num_partitions=8,
+            idf_tolerance=0.001,
+            chunk_size=64,
+            **COLUMNS,
+        )
+        is None
+    )
+
+    incremental.main(args + ["-d", str(tmp_path / "delta.parquet")])
+    with open(join(state, "meta.json")) as f:
+        assert json.load(f)["updates_since_rebuild"] == 0
+
+    full = str(tmp_path / "full")
+    incremental.rebuild(
+        full,
+        edge_df,
+        top_n=TOP_N,
+        num_partitions=8,
+        chunk_size=64,
+        executor="thread",
+        **COLUMNS,
+    )
+    assert_same_interactions(
+        read_interactions(join(state, "interactions")),
+        read_interactions(join(full, "interactions")),
+    )
+
+
+def test_rebuild_every(tmp_path, base_edges):
+    state = str(tmp_path / "state")
+    base_edges.to_parquet(tmp_path / "edge.parquet", index=False)
+    base_edges.head(10).to_parquet(tmp_path / "delta.parquet", index=False)
+    args = cli_args(state, idf_tolerance=1.0) + ["--rebuild-every", "2"]
+
+    updates = []
+    for delta in ["edge", "delta", "delta", "delta"]:
+        incremental.main(args + ["-d", str(tmp_path / f"{delta}.parquet")])
+        with open(join(state, "meta.json")) as f:
+            updates.append(json.load(f)["updates_since_rebuild"])
+    assert updates == [0, 1, 0, 1]
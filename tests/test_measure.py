@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, random as sparse_random
+from sklearn.preprocessing import normalize
+from sparse_dot_topn import sp_matmul_topn
+
+from tcd.measure import iter_symmetric_topn
+
+
+def random_docs(num_rows=500, num_cols=200, density=0.03, seed=0):
+    A = sparse_random(num_rows, num_cols, density=density, random_state=seed)
+    A = csr_matrix(A)
+    A = A[np.diff(A.indptr) > 0]
+    return csr_matrix(normalize(A))
+
+
+@pytest.mark.parametrize("top_n", [1, 2, 5, 20])
+def test_symmetric_topn_counts_self_like_sp_matmul_topn(top_n):
+    A = random_docs()
+
+    # pairs in the exact top-n list of either user, self match excluded
+    exact = sp_matmul_topn(A, csr_matrix(A.T), top_n=top_n).tocoo()
+    not_self = exact.row != exact.col
+    expected = {
+        (min(u1, u2), max(u1, u2))
+        for u1, u2 in zip(exact.row[not_self].tolist(), exact.col[not_self].tolist())
+    }
+
+    found = set()
+    for u1, u2, _ in iter_symmetric_topn(
+        A, top_n=top_n, chunk_size=128, executor="thread"
+    ):
+        found |= set(zip(u1.tolist(), u2.tolist()))
+    assert found == expected